@@ -2,15 +2,24 @@
 Configuration settings for Lethai Concierge Referral Bot
 """
 import os
-from typing import List, Dict, Any
-from dotenv import load_dotenv
+import re
+from types import MappingProxyType
+from typing import List, Any, FrozenSet, Mapping, Optional, Pattern, Match
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env once per process tree; values that
+# are already set (e.g. by the container) take precedence
+if not os.environ.get('_LETHAI_ENV_LOADED'):
+    from dotenv import load_dotenv
+    
+    load_dotenv(override=False)
+    os.environ['_LETHAI_ENV_LOADED'] = '1'
 
 class Config:
     """Bot configuration class"""
     
+    # Settings live on the class; instances carry no per-object state
+    __slots__ = ()
+    
     # Bot settings
     BOT_TOKEN: str = os.getenv('BOT_TOKEN', '')
     BOT_NAME: str = "Lethai Concierge Referral Bot"
@@ -19,6 +28,10 @@ class Config:
     # Admin settings
     ADMIN_USER_ID: int = int(os.getenv('ADMIN_USER_ID', '1454702347'))
     ADMIN_GROUP_ID: str = os.getenv('ADMIN_GROUP_ID', '-1003016595712')
+    # Additional admins as comma-separated IDs; the main admin is always included
+    ADMIN_USER_IDS: FrozenSet[int] = frozenset(
+        int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()
+    ) | {ADMIN_USER_ID}
     
     # Google Sheets settings
     SHEETS_ID: str = os.getenv('SHEETS_ID', '18dY652fOqEJ6EC1ppMlMF0Obzlzu32xxVXt5AJ9415A')
@@ -28,8 +41,18 @@ class Config:
     # Database settings
     DATABASE_PATH: str = 'users.db'
     
+    # Last handled Telegram update, kept across restarts
+    UPDATE_OFFSET_PATH: str = os.getenv('UPDATE_OFFSET_PATH', '.state/offset.json')
+    
+    # Last downloaded worksheet rows, served right after a restart
+    SHEETS_CACHE_PATH: str = os.getenv('SHEETS_CACHE_PATH', '.state/sheets_cache.db')
+    
+    # FSM storage (Redis is used when set, e.g. redis://localhost:6379/0)
+    REDIS_URL: str = os.getenv('REDIS_URL', '')
+    
     # Referral settings
     REFERRAL_BASE_URL: str = 'https://taplink.cc/lakeevainfo'
+    REFERRAL_LINK_PREFIX: str = REFERRAL_BASE_URL + '?ref='
     SUPPORT_USERNAME: str = '@LakeevaaaThai'
     
     # QR Code settings
@@ -58,7 +81,7 @@ class Config:
     MAX_PHONE_LENGTH: int = 20
     
     # Message templates
-    MESSAGES: Dict[str, str] = {
+    MESSAGES: Mapping[str, str] = MappingProxyType({
         'welcome': (
             "🏝️ Добро пожаловать в реферальную систему Lethai!\n\n"
             "Для регистрации поделитесь своим контактом, нажав кнопку ниже:"
@@ -113,10 +136,10 @@ class Config:
         'error_qr': "Произошла ошибка при генерации реферальной ссылки. Попробуйте позже.",
         'error_database': "Ошибка базы данных. Попробуйте позже.",
         'error_sheets': "Ошибка подключения к Google Sheets. Попробуйте позже.",
-    }
+    })
     
     # Keyboard layouts
-    KEYBOARDS: Dict[str, List[List[str]]] = {
+    KEYBOARDS: Mapping[str, List[List[str]]] = MappingProxyType({
         'main_menu': [
             ["Моя реферальная ссылка"],
             ["Посмотреть баланс"],
@@ -125,17 +148,23 @@ class Config:
         'contact_share': [
             ["📱 Поделиться контактом"]
         ]
-    }
+    })
     
     # Validation patterns
-    PATTERNS: Dict[str, str] = {
+    PATTERNS: Mapping[str, str] = MappingProxyType({
         'phone': r'^\+?[1-9]\d{1,14}$',
         'name': r'^[a-zA-Zа-яА-ЯёЁ\s\-\.]{2,50}$',
         'telegram_id': r'^\d+$'
-    }
+    })
+    
+    # Compiled once at import; numeric patterns only need ASCII digits
+    COMPILED_PATTERNS: Mapping[str, Pattern[str]] = MappingProxyType({
+        key: re.compile(pattern, re.ASCII if key in ('phone', 'telegram_id') else 0)
+        for key, pattern in PATTERNS.items()
+    })
     
     # Error messages
-    ERRORS: Dict[str, str] = {
+    ERRORS: Mapping[str, str] = MappingProxyType({
         'invalid_name': "Пожалуйста, введите корректное имя (минимум 2 символа):",
         'name_too_long': "Имя слишком длинное. Пожалуйста, введите имя до 50 символов:",
         'invalid_phone': "Не удалось получить номер телефона. Попробуйте еще раз:",
@@ -145,7 +174,7 @@ class Config:
         'user_already_approved': "❌ Пользователь уже одобрен.",
         'sheets_connection_failed': "❌ Ошибка подключения к Google Sheets.",
         'database_error': "❌ Ошибка базы данных.",
-    }
+    })
     
     @classmethod
     def validate(cls) -> List[str]:
@@ -166,10 +195,15 @@ class Config:
         
         return errors
     
+    @classmethod
+    def match(cls, kind: str, value: str) -> Optional[Match[str]]:
+        """Match value against a precompiled validation pattern"""
+        return cls.COMPILED_PATTERNS[kind].match(value)
+    
     @classmethod
     def get_referral_link(cls, partnercode: str) -> str:
         """Generate referral link for partner code"""
-        return f"{cls.REFERRAL_BASE_URL}?ref={partnercode}"
+        return cls.REFERRAL_LINK_PREFIX + partnercode
     
     @classmethod
     def get_support_link(cls) -> str:
@@ -179,7 +213,7 @@ class Config:
     @classmethod
     def is_admin(cls, user_id: int) -> bool:
         """Check if user is admin"""
-        return user_id == cls.ADMIN_USER_ID
+        return user_id in cls.ADMIN_USER_IDS
 
 # Create global config instance
 config = Config()
@@ -1,6 +1,7 @@
+import ast
+import json
 import os
 import sys
-import pkg_resources
 from pathlib import Path
 import importlib.util
 import builtins
@@ -8,37 +9,82 @@ import builtins
 PROJECT_DIR = Path(__file__).parent
 
 # Получаем список стандартных модулей Python
-STANDARD_MODULES = set(sys.builtin_module_names)
-# Добавим модули из стандартной библиотеки, которые часто встречаются
-EXTRA_STANDARD = {
-    'os', 'sys', 'math', 'json', 're', 'time', 'threading', 'subprocess',
-    'collections', 'itertools', 'functools', 'logging', 'enum', 'pathlib',
-    'random', 'asyncio', 'typing', 'abc', 'inspect', 'copy', 'contextlib',
-    'dataclasses', 'io', 'traceback', 'shlex', 'pickle', 'tempfile', 'hashlib',
-    'operator', 'sqlite3', 'struct', 'socket', 'ssl', 'email', 'http', 'argparse',
-    'glob', 'gzip', 'shutil', 'tarfile', 'zipfile', 'platform', 'getpass'
-}
-STANDARD_MODULES.update(EXTRA_STANDARD)
+if sys.version_info >= (3, 10):
+    STANDARD_MODULES = frozenset(sys.stdlib_module_names) | frozenset(sys.builtin_module_names)
+else:
+    STANDARD_MODULES = set(sys.builtin_module_names)
+    # Добавим модули из стандартной библиотеки, которые часто встречаются
+    EXTRA_STANDARD = {
+        'os', 'sys', 'math', 'json', 're', 'time', 'threading', 'subprocess',
+        'collections', 'itertools', 'functools', 'logging', 'enum', 'pathlib',
+        'random', 'asyncio', 'typing', 'abc', 'inspect', 'copy', 'contextlib',
+        'dataclasses', 'io', 'traceback', 'shlex', 'pickle', 'tempfile', 'hashlib',
+        'operator', 'sqlite3', 'struct', 'socket', 'ssl', 'email', 'http', 'argparse',
+        'glob', 'gzip', 'shutil', 'tarfile', 'zipfile', 'platform', 'getpass'
+    }
+    STANDARD_MODULES.update(EXTRA_STANDARD)
+    STANDARD_MODULES = frozenset(STANDARD_MODULES)
+
+# Кэш импортов по файлам: путь -> [mtime, [импорты]]
+CACHE_FILE = PROJECT_DIR / ".reqgen_cache.json"
+
+def load_cache():
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        print(f"Не удалось сохранить кэш {CACHE_FILE}: {e}")
+
+# Собираем импорты одного файла через ast (включая импорты внутри функций)
+def parse_imports(source):
+    imports = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.add(alias.name.split(".")[0])
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            imports.add(node.module.split(".")[0])
+    return imports
 
 # Функция для сбора всех импортов из проекта
 def get_project_imports(project_dir):
+    cache = load_cache()
+    new_cache = {}
     imports = set()
     for py_file in project_dir.rglob("*.py"):
+        key = str(py_file)
         try:
-            with open(py_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith("import "):
-                        imports.add(line.split()[1].split(".")[0])
-                    elif line.startswith("from "):
-                        imports.add(line.split()[1].split(".")[0])
+            mtime = py_file.stat().st_mtime
+            cached = cache.get(key)
+            if cached and cached[0] == mtime:
+                file_imports = cached[1]
+            else:
+                with open(py_file, "r", encoding="utf-8") as f:
+                    file_imports = sorted(parse_imports(f.read()))
+            new_cache[key] = [mtime, file_imports]
+            imports.update(file_imports)
         except Exception as e:
             print(f"Не удалось прочитать {py_file}: {e}")
+    save_cache(new_cache)
     return imports
 
 # Получаем версии установленных пакетов
 def get_installed_packages():
-    return {pkg.key: pkg.version for pkg in pkg_resources.working_set}
+    # importlib.metadata импортируется намного быстрее, чем pkg_resources
+    from importlib.metadata import distributions
+    packages = {}
+    for dist in distributions():
+        name = dist.metadata["Name"]
+        if name:
+            packages.setdefault(name.lower(), dist.version)
+    return packages
 
 def main():
     project_imports = get_project_imports(PROJECT_DIR)
@@ -1,35 +1,83 @@
 """
 Admin commands and interface for approving/rejecting users
 """
+import asyncio
 import logging
-import os
+import time
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Tuple
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
-from utils.database import get_pending_users, update_user_approval, get_user, get_approved_users
-from utils.sheets import add_partnercode
-from health import HealthChecker
+from config import config
+from utils.database import (
+    get_pending_users_async,
+    approve_pending_user_async,
+    get_user_async,
+    get_approved_users_async,
+    get_user_counts_async,
+)
+from utils.sheets import add_partnercode_async, get_worksheet_info_async, test_connection_async
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-def get_admin_user_id() -> int:
-    """Get admin user ID from environment"""
-    return int(os.getenv('ADMIN_USER_ID', '1454702347'))
+# Keep chunks safely below Telegram's 4096-character message limit
+MESSAGE_CHUNK_SIZE = 3800
 
-def get_admin_group_id() -> str:
-    """Get admin group ID from environment"""
-    return os.getenv('ADMIN_GROUP_ID', '-1003016595712')
+# Pending users shown (with buttons) per /admin call
+PENDING_PAGE_SIZE = 5
+
+# Approved users shown per /users call
+USERS_PAGE_SIZE = 20
+
+# Build admin keyboards without pydantic validation (values are known-good)
+FAST_CONSTRUCT = True
+
+# Short-lived cache for admin lookups: key -> (expires_at, value)
+CACHE_TTL = 5  # seconds
+_cache: Dict[str, Tuple[float, Any]] = {}
+
+async def _cached(key: str, ttl: float, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Return cached result of await fn() for key, recomputing it after ttl seconds"""
+    now = time.monotonic()
+    entry = _cache.get(key)
+    if entry and entry[0] > now:
+        return entry[1]
+    value = await fn()
+    _cache[key] = (now + ttl, value)
+    return value
+
+def _invalidate_cache() -> None:
+    """Drop cached admin lookups after a user's approval status changes"""
+    _cache.clear()
+
+# Admin identifiers are fixed for the lifetime of the process
+ADMIN_IDS: FrozenSet[int] = config.ADMIN_USER_IDS
+_ADMIN_GROUP_ID: str = config.ADMIN_GROUP_ID
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
-    admin_user_id = get_admin_user_id()
-    logger.info(f"Checking admin status for user {user_id}, admin ID is {admin_user_id}")
-    is_admin_result = user_id == admin_user_id
-    logger.info(f"User {user_id} admin status: {is_admin_result}")
-    return is_admin_result
+    return user_id in ADMIN_IDS
+
+async def _answer_in_chunks(message: types.Message, header: str, entries: List[str]) -> None:
+    """Send entries as few messages as possible, splitting only between entries"""
+    chunk = [header]
+    chunk_size = len(header)
+    
+    for entry in entries:
+        # Send what we have before exceeding Telegram's message limit
+        if chunk_size + len(entry) > MESSAGE_CHUNK_SIZE:
+            await message.answer("".join(chunk))
+            chunk.clear()
+            chunk_size = 0
+        
+        chunk.append(entry)
+        chunk_size += len(entry)
+    
+    await message.answer("".join(chunk))
 
 @router.message(Command("admin"))
 async def admin_panel(message: types.Message):
@@ -48,7 +96,8 @@ async def admin_panel(message: types.Message):
         logger.info(f"✅ User {user_id} is admin, showing admin panel")
         
         # Get pending users
-        pending_users = get_pending_users()
+        # Fetch one extra row to tell whether more users are waiting
+        pending_users = await _cached('pending', CACHE_TTL, lambda: get_pending_users_async(limit=PENDING_PAGE_SIZE + 1))
         
         if not pending_users:
             await message.answer(
@@ -57,33 +106,43 @@ async def admin_panel(message: types.Message):
             )
             return
         
-        # Show pending users
-        text = "👥 Админ панель\n\n📋 Пользователи, ожидающие подтверждения:\n\n"
-        
-        for i, user in enumerate(pending_users[:10], 1):  # Limit to 10 users
-            text += f"{i}. ID: {user['telegram_id']}\n"
-            text += f"   Имя: {user['name']}\n"
-            text += f"   Телефон: {user['phone']}\n"
-            text += f"   Дата: {user['created_at']}\n\n"
-        
-        if len(pending_users) > 10:
-            text += f"... и еще {len(pending_users) - 10} пользователей\n\n"
-        
-        # Create inline keyboard for each pending user
+        # Show pending users; each listed user gets approve/reject buttons
+        visible = pending_users[:PENDING_PAGE_SIZE]
+        button = InlineKeyboardButton.model_construct if FAST_CONSTRUCT else InlineKeyboardButton
+        parts = ["👥 Админ панель\n\n📋 Пользователи, ожидающие подтверждения:\n\n"]
         keyboard_buttons = []
-        for user in pending_users[:5]:  # Limit to 5 buttons
+        
+        for i, user in enumerate(visible, 1):
+            telegram_id = user['telegram_id']
+            name = user['name']
+            parts.append(
+                f"{i}. ID: {telegram_id}\n"
+                f"   Имя: {name}\n"
+                f"   Телефон: {user['phone']}\n"
+                f"   Дата: {user['created_at']}\n\n"
+            )
             keyboard_buttons.append([
-                InlineKeyboardButton(
-                    text=f"✅ {user['name']} ({user['telegram_id']})",
-                    callback_data=f"approve_{user['telegram_id']}"
+                button(
+                    text=f"✅ {name} ({telegram_id})",
+                    callback_data=f"approve_{telegram_id}"
                 ),
-                InlineKeyboardButton(
-                    text=f"❌ Отклонить",
-                    callback_data=f"reject_{user['telegram_id']}"
+                button(
+                    text="❌ Отклонить",
+                    callback_data=f"reject_{telegram_id}"
                 )
             ])
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+        if len(pending_users) > PENDING_PAGE_SIZE:
+            remaining = (await _cached('counts', CACHE_TTL, get_user_counts_async))['pending'] - PENDING_PAGE_SIZE
+            if remaining > 0:
+                parts.append(f"... и еще {remaining} пользователей\n\n")
+        
+        text = "".join(parts)
+        
+        if FAST_CONSTRUCT:
+            keyboard = InlineKeyboardMarkup.model_construct(inline_keyboard=keyboard_buttons)
+        else:
+            keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
         
         await message.answer(text, reply_markup=keyboard)
         
@@ -102,22 +161,14 @@ async def approve_user(callback: CallbackQuery):
         # Extract user ID from callback data
         user_id = int(callback.data.split("_")[1])
         
-        # Get user info
-        user = get_user(user_id)
-        if not user:
-            await callback.answer("❌ Пользователь не найден.", show_alert=True)
-            return
-        
-        if user['approved']:
-            await callback.answer("❌ Пользователь уже одобрен.", show_alert=True)
-            return
+        # Approve and fetch the user in a single statement
+        user = await approve_pending_user_async(user_id)
         
-        # Update user approval status
-        success = update_user_approval(user_id, True)
-        
-        if success:
+        if user:
+            _invalidate_cache()
+            
             # Add partnercode to Google Sheets with full user data
-            sheets_success = add_partnercode(
+            sheets_success = await add_partnercode_async(
                 partnercode=str(user_id),
                 name=user['name'],
                 contact=user['phone'],
@@ -147,7 +198,14 @@ async def approve_user(callback: CallbackQuery):
             else:
                 await callback.answer("❌ Ошибка при добавлении в Google Sheets.", show_alert=True)
         else:
-            await callback.answer("❌ Ошибка при обновлении статуса пользователя.", show_alert=True)
+            # Nothing was updated; look the user up only to explain why
+            existing = await get_user_async(user_id)
+            if not existing:
+                await callback.answer("❌ Пользователь не найден.", show_alert=True)
+            elif existing['approved']:
+                await callback.answer("❌ Пользователь уже одобрен.", show_alert=True)
+            else:
+                await callback.answer("❌ Ошибка при обновлении статуса пользователя.", show_alert=True)
             
     except Exception as e:
         logger.error(f"Error approving user: {e}")
@@ -165,29 +223,28 @@ async def reject_user(callback: CallbackQuery):
         user_id = int(callback.data.split("_")[1])
         
         # Get user info
-        user = get_user(user_id)
+        user = await get_user_async(user_id)
         if not user:
             await callback.answer("❌ Пользователь не найден.", show_alert=True)
             return
         
-        # Notify user
-        try:
-            await callback.bot.send_message(
+        # Notify user and admin group concurrently (short message, no duplication)
+        user_res, group_res = await asyncio.gather(
+            callback.bot.send_message(
                 chat_id=user_id,
                 text="❌ К сожалению, ваша заявка была отклонена.\n\n"
                      "По вопросам обращайтесь в поддержку: @LakeevaaaThai"
-            )
-        except Exception as e:
-            logger.error(f"Error notifying user {user_id}: {e}")
-        
-        # Notify admin group (short message, no duplication)
-        try:
-            await callback.bot.send_message(
-                chat_id=get_admin_group_id(),
+            ),
+            callback.bot.send_message(
+                chat_id=_ADMIN_GROUP_ID,
                 text=f"❌ {user['name']} отклонен"
-            )
-        except Exception as e:
-            logger.error(f"Error notifying admin group: {e}")
+            ),
+            return_exceptions=True
+        )
+        if isinstance(user_res, Exception):
+            logger.error(f"Error notifying user {user_id}: {user_res}")
+        if isinstance(group_res, Exception):
+            logger.error(f"Error notifying admin group: {group_res}")
         
         await callback.answer("❌ Пользователь отклонен!", show_alert=True)
         
@@ -212,19 +269,16 @@ async def admin_stats(message: types.Message):
             return
         
         # Get statistics
-        pending_users = get_pending_users()
-        approved_users = get_approved_users()
+        counts = await _cached('counts', CACHE_TTL, get_user_counts_async)
         
         # Get Google Sheets info
-        from utils.sheets import get_worksheet_info, test_connection
-        
-        sheets_connected = test_connection()
-        sheets_info = get_worksheet_info() if sheets_connected else {}
+        sheets_connected = await test_connection_async()
+        sheets_info = await get_worksheet_info_async() if sheets_connected else {}
         
         text = "📊 Статистика реферальной системы\n\n"
-        text += f"⏳ Ожидают подтверждения: {len(pending_users)}\n"
-        text += f"✅ Одобренных пользователей: {len(approved_users)}\n"
-        text += f"📈 Всего зарегистрированных: {len(pending_users) + len(approved_users)}\n\n"
+        text += f"⏳ Ожидают подтверждения: {counts['pending']}\n"
+        text += f"✅ Одобренных пользователей: {counts['approved']}\n"
+        text += f"📈 Всего зарегистрированных: {counts['pending'] + counts['approved']}\n\n"
         
         if sheets_connected:
             text += f"📋 Google Sheets:\n"
@@ -251,37 +305,42 @@ async def list_users(message: types.Message):
             await message.answer("❌ У вас нет прав администратора.")
             return
         
-        approved_users = get_approved_users()
+        approved_users = await _cached('approved', CACHE_TTL, lambda: get_approved_users_async(limit=USERS_PAGE_SIZE))
         
         if not approved_users:
             await message.answer("📋 Нет одобренных пользователей.")
             return
         
-        text = "👥 Одобренные пользователи:\n\n"
+        entries = [
+            f"{i}. ID: {user['telegram_id']}\n"
+            f"   Имя: {user['name']}\n"
+            f"   Телефон: {user['phone']}\n"
+            f"   Одобрен: {user['approved_at']}\n"
+            f"   Ссылка: {config.get_referral_link(str(user['telegram_id']))}\n\n"
+            for i, user in enumerate(approved_users, 1)
+        ]
         
-        for i, user in enumerate(approved_users[:20], 1):  # Limit to 20 users
-            text += f"{i}. ID: {user['telegram_id']}\n"
-            text += f"   Имя: {user['name']}\n"
-            text += f"   Телефон: {user['phone']}\n"
-            text += f"   Одобрен: {user['approved_at']}\n"
-            text += f"   Ссылка: https://taplink.cc/lakeevainfo?ref={user['telegram_id']}\n\n"
+        if len(approved_users) == USERS_PAGE_SIZE:
+            remaining = (await _cached('counts', CACHE_TTL, get_user_counts_async))['approved'] - USERS_PAGE_SIZE
+            if remaining > 0:
+                entries.append(f"... и еще {remaining} пользователей\n")
         
-        if len(approved_users) > 20:
-            text += f"... и еще {len(approved_users) - 20} пользователей\n"
-        
-        # Split message if too long
-        if len(text) > 4000:
-            # Send in chunks
-            chunks = [text[i:i+4000] for i in range(0, len(text), 4000)]
-            for chunk in chunks:
-                await message.answer(chunk)
-        else:
-            await message.answer(text)
+        await _answer_in_chunks(message, "👥 Одобренные пользователи:\n\n", entries)
         
     except Exception as e:
         logger.error(f"Error listing users: {e}")
         await message.answer("Произошла ошибка при получении списка пользователей.")
 
+def _format_health_check(check_name: str, check_result: Dict[str, Any]) -> str:
+    """Format a single health check result for the /health message"""
+    check_icon = "✅" if check_result['status'] == 'healthy' else "❌"
+    check_title = check_name.replace('_', ' ').title()
+    details = "".join(
+        f"   • {key}: {value}\n"
+        for key, value in islice(check_result['details'].items(), 3)  # Limit to 3 details
+    )
+    return f"{check_icon} {check_title}:\n   {check_result['message']}\n{details}\n"
+
 @router.message(Command("health"))
 async def health_check(message: types.Message):
     """Check bot system health"""
@@ -294,25 +353,21 @@ async def health_check(message: types.Message):
             return
         
         # Run health checks
-        health = HealthChecker.run_all_checks()
+        from health import HealthChecker
+        
+        health = await HealthChecker.run_all_checks_async()
         
         # Build status message
         status_icon = "✅" if health['status'] == 'healthy' else "❌"
-        text = f"🏥 Состояние системы: {status_icon} {health['status'].upper()}\n\n"
-        text += f"📊 Проверок выполнено: {health['summary']['healthy_checks']}/{health['summary']['total_checks']}\n\n"
-        
-        for check_name, check_result in health['checks'].items():
-            check_icon = "✅" if check_result['status'] == 'healthy' else "❌"
-            check_title = check_name.replace('_', ' ').title()
-            text += f"{check_icon} {check_title}:\n"
-            text += f"   {check_result['message']}\n"
-            
-            if check_result['details']:
-                for key, value in list(check_result['details'].items())[:3]:  # Limit to 3 details
-                    text += f"   • {key}: {value}\n"
-            text += "\n"
-        
-        text += f"🕐 Время проверки: {health['timestamp']}"
+        text = "".join((
+            f"🏥 Состояние системы: {status_icon} {health['status'].upper()}\n\n",
+            f"📊 Проверок выполнено: {health['summary']['healthy_checks']}/{health['summary']['total_checks']}\n\n",
+            "".join(
+                _format_health_check(check_name, check_result)
+                for check_name, check_result in health['checks'].items()
+            ),
+            f"🕐 Время проверки: {health['timestamp']}",
+        ))
         
         await message.answer(text)
         
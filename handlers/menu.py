@@ -2,33 +2,42 @@
 User menu command handlers for Lethai Concierge Referral Bot
 """
 import logging
-from aiogram import Router
+from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 
 from config import config
-from utils.sheets import get_balance
+from utils.sheets import get_balance_async
 from utils.qr_code import generate_qr_code_bytes
-from utils.database import is_user_approved
+from utils.database import is_user_approved_async
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-def get_main_menu() -> ReplyKeyboardMarkup:
-    """Create main menu keyboard"""
-    buttons = [
+# Static layout, so the keyboard is built once and shared by all replies
+MAIN_MENU_MARKUP = ReplyKeyboardMarkup(
+    keyboard=[
         [KeyboardButton(text=button) for button in row]
         for row in config.KEYBOARDS['main_menu']
-    ]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    ],
+    resize_keyboard=True
+)
 
-@router.message(lambda message: message.text == "Моя реферальная ссылка")
+# Static reply texts resolved once instead of on every message
+APPROVAL_WAITING_TEXT = config.MESSAGES['approval_waiting']
+SUPPORT_INFO_TEXT = config.MESSAGES['support_info']
+REFERRAL_LINK_TEMPLATE = config.MESSAGES['referral_link']
+BALANCE_INFO_TEMPLATE = config.MESSAGES['balance_info']
+ERROR_QR_TEXT = config.MESSAGES['error_qr']
+ERROR_BALANCE_TEXT = config.MESSAGES['error_balance']
+
+@router.message(F.text == "Моя реферальная ссылка")
 async def get_referral_link(message: Message):
     """Handle request for referral link and QR code"""
-    if not is_user_approved(message.from_user.id):
-        await message.answer(config.MESSAGES['approval_waiting'])
+    if not await is_user_approved_async(message.from_user.id):
+        await message.answer(APPROVAL_WAITING_TEXT)
         return
 
     partnercode = str(message.from_user.id)
@@ -36,42 +45,42 @@ async def get_referral_link(message: Message):
     qr_bytes = generate_qr_code_bytes(partnercode)
 
     if not qr_bytes:
-        await message.answer(config.MESSAGES['error_qr'])
+        await message.answer(ERROR_QR_TEXT)
         return
 
-    await message.answer(config.MESSAGES['referral_link'].format(link=link))
+    await message.answer(REFERRAL_LINK_TEMPLATE.format(link=link))
     await message.answer_photo(
         photo=qr_bytes,
         caption="Ваш реферальный QR-код"
     )
 
-@router.message(lambda message: message.text == "Посмотреть баланс")
+@router.message(F.text == "Посмотреть баланс")
 async def check_balance(message: Message):
     """Handle balance check request"""
-    if not is_user_approved(message.from_user.id):
-        await message.answer(config.MESSAGES['approval_waiting'])
+    if not await is_user_approved_async(message.from_user.id):
+        await message.answer(APPROVAL_WAITING_TEXT)
         return
 
     partnercode = str(message.from_user.id)
-    balance = get_balance(partnercode)
+    balance = await get_balance_async(partnercode)
 
     if balance is None:
-        await message.answer(config.MESSAGES['error_balance'])
+        await message.answer(ERROR_BALANCE_TEXT)
         return
 
     await message.answer(
-        config.MESSAGES['balance_info'].format(balance=balance),
-        reply_markup=get_main_menu()
+        BALANCE_INFO_TEMPLATE.format(balance=balance),
+        reply_markup=MAIN_MENU_MARKUP
     )
 
-@router.message(lambda message: message.text == "Поддержка")
+@router.message(F.text == "Поддержка")
 async def contact_support(message: Message):
     """Handle support request"""
-    if not is_user_approved(message.from_user.id):
-        await message.answer(config.MESSAGES['approval_waiting'])
+    if not await is_user_approved_async(message.from_user.id):
+        await message.answer(APPROVAL_WAITING_TEXT)
         return
 
     await message.answer(
-        config.MESSAGES['support_info'],
-        reply_markup=get_main_menu()
+        SUPPORT_INFO_TEXT,
+        reply_markup=MAIN_MENU_MARKUP
     )
\ No newline at end of file
@@ -2,23 +2,29 @@
 Start command and registration flow handlers
 """
 import logging
-import os
+from typing import Dict
 from aiogram import Router, types, F
 from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import (
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardRemove,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+)
 
-from utils.database import save_user, get_user, is_user_approved
-from utils.sheets import add_partnercode
+from config import config
+from handlers.admin import admin_stats, list_users, admin_panel, health_check
+from middlewares.user_context import UserContext
+from utils.database import save_user_async, set_qr_file_id_async
+from utils.sheets import get_balance_async
+from utils.qr_code import get_referral_link, generate_qr_code_bytes
 from keyboards.admin import get_admin_keyboard
 
 logger = logging.getLogger(__name__)
 
-def get_admin_group_id() -> str:
-    """Get admin group ID from environment"""
-    return os.getenv('ADMIN_GROUP_ID', '-1003016595712')
-
 # FSM States
 class Register(StatesGroup):
     phone = State()
@@ -39,15 +45,34 @@ def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
         one_time_keyboard=False
     )
 
+# Admin group notification about a new application
+NEW_APPLICATION_TEMPLATE = (
+    "🆕 Новая заявка\n\n"
+    "👤 {name}\n"
+    "📱 {phone}\n"
+    "🆔 {uid}\n\n"
+    "Используйте /admin для рассмотрения"
+)
+
+# Telegram file_id of each user's uploaded QR code, so it is generated once
+# (persisted in users.qr_file_id; this dict saves the lookup on repeat taps)
+_qr_file_ids: Dict[int, str] = {}
+
+# Static keyboards, built once and shared by all replies
+MAIN_MENU_KB = get_main_menu_keyboard()
+ADMIN_KB = get_admin_keyboard()
+CONTACT_KB = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
 @router.message(CommandStart())
-async def start_command(message: types.Message, state: FSMContext):
+async def start_command(message: types.Message, state: FSMContext, user_ctx: UserContext):
     """Handle /start command"""
     try:
-        user_id = message.from_user.id
-        
         # Check if user is admin
-        from handlers.admin import is_admin
-        if is_admin(user_id):
+        if user_ctx.is_admin:
             await message.answer(
                 "👑 Welcome, Administrator!\n\n"
                 "You have access to administrative functions.\n"
@@ -57,12 +82,12 @@ async def start_command(message: types.Message, state: FSMContext):
                 "/users - List approved users\n"
                 "/health - System health check\n\n"
                 "Note: Admins do not receive referral codes.",
-                reply_markup=get_admin_keyboard()
+                reply_markup=ADMIN_KB
             )
             return
         
         # Check if user already exists
-        user = get_user(user_id)
+        user = await user_ctx.get_user()
         
         if user:
             if user['approved']:
@@ -70,7 +95,7 @@ async def start_command(message: types.Message, state: FSMContext):
                 await message.answer(
                     "Добро пожаловать в реферальную систему Lethai! 🏝️\n\n"
                     "Выберите действие из меню ниже:",
-                    reply_markup=get_main_menu_keyboard()
+                    reply_markup=MAIN_MENU_KB
                 )
             else:
                 # User exists but not approved
@@ -83,11 +108,7 @@ async def start_command(message: types.Message, state: FSMContext):
             await message.answer(
                 "🏝️ Добро пожаловать в реферальную систему Lethai!\n\n"
                 "Для регистрации поделитесь своим контактом, нажав кнопку ниже:",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]],
-                    resize_keyboard=True,
-                    one_time_keyboard=True
-                )
+                reply_markup=CONTACT_KB
             )
             await state.set_state(Register.phone)
             
@@ -107,11 +128,7 @@ async def process_contact(message: types.Message, state: FSMContext):
         if not contact.phone_number:
             await message.answer(
                 "Не удалось получить номер телефона. Попробуйте еще раз:",
-                reply_markup=ReplyKeyboardMarkup(
-                    keyboard=[[KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]],
-                    resize_keyboard=True,
-                    one_time_keyboard=True
-                )
+                reply_markup=CONTACT_KB
             )
             return
         
@@ -136,11 +153,7 @@ async def invalid_contact(message: types.Message, state: FSMContext):
     """Handle invalid contact input"""
     await message.answer(
         "Пожалуйста, поделитесь контактом, нажав кнопку:",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+        reply_markup=CONTACT_KB
     )
 
 @router.message(Register.name)
@@ -175,19 +188,21 @@ async def process_name(message: types.Message, state: FSMContext):
         
         # Save user to database
         user_id = message.from_user.id
-        success = save_user(user_id, name, phone, approved=False)
+        success = await save_user_async(user_id, name, phone, approved=False)
         
         if success:
             # Notify admin group with avatar and chat button
             try:
-                from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                
                 # Get user profile photos
                 photos = await message.bot.get_user_profile_photos(user_id, limit=1)
                 photo = None
                 if photos.total_count > 0:
                     photo = photos.photos[0][-1].file_id
 
+                notification = NEW_APPLICATION_TEMPLATE.format_map(
+                    {'uid': user_id, 'name': name, 'phone': phone}
+                )
+
                 # Create inline keyboard with button to open chat
                 keyboard = InlineKeyboardMarkup(
                     inline_keyboard=[
@@ -198,23 +213,15 @@ async def process_name(message: types.Message, state: FSMContext):
                 # Send notification with photo if available
                 if photo:
                     await message.bot.send_photo(
-                        chat_id=get_admin_group_id(),
+                        chat_id=config.ADMIN_GROUP_ID,
                         photo=photo,
-                        caption=f"🆕 Новая заявка\n\n"
-                                f"👤 {name}\n"
-                                f"📱 {phone}\n"
-                                f"🆔 {user_id}\n\n"
-                                f"Используйте /admin для рассмотрения",
+                        caption=notification,
                         reply_markup=keyboard
                     )
                 else:
                     await message.bot.send_message(
-                        chat_id=get_admin_group_id(),
-                        text=f"🆕 Новая заявка\n\n"
-                             f"👤 {name}\n"
-                             f"📱 {phone}\n"
-                             f"🆔 {user_id}\n\n"
-                             f"Используйте /admin для рассмотрения",
+                        chat_id=config.ADMIN_GROUP_ID,
+                        text=notification,
                         reply_markup=keyboard
                     )
             except Exception as e:
@@ -239,15 +246,13 @@ async def process_name(message: types.Message, state: FSMContext):
             "Произошла ошибка при обработке имени. Попробуйте еще раз."
         )
 
-@router.message(F.text == "Моя реферальная ссылка")
-async def show_referral_link(message: types.Message):
+async def show_referral_link(message: types.Message, user_ctx: UserContext):
     """Show user's referral link and QR code"""
     try:
         user_id = message.from_user.id
         
         # Check if user is admin - admins don't have referral codes
-        from handlers.admin import is_admin
-        if is_admin(user_id):
+        if user_ctx.is_admin:
             await message.answer(
                 "⚠️ Administrators do not have referral codes.\n"
                 "This feature is only for regular users."
@@ -255,7 +260,7 @@ async def show_referral_link(message: types.Message):
             return
         
         # Check if user is approved
-        if not is_user_approved(user_id):
+        if not await user_ctx.is_approved():
             await message.answer(
                 "Ожидайте подтверждения в реферальной системе.\n"
                 "Реферальная ссылка будет доступна после одобрения заявки."
@@ -263,26 +268,38 @@ async def show_referral_link(message: types.Message):
             return
         
         # Generate referral link
-        from utils.qr_code import get_referral_link, generate_qr_code_bytes
-        
         referral_link = get_referral_link(str(user_id))
+        caption = (
+            f"🔗 Ваша реферальная ссылка:\n\n{referral_link}\n\n"
+            f"Поделитесь этой ссылкой с друзьями и получайте бонусы за каждую регистрацию! 🎁"
+        )
+        
+        # Reuse the QR code already uploaded to Telegram for this user;
+        # the file_id survives restarts in the users table
+        file_id = _qr_file_ids.get(user_id)
+        if file_id is None:
+            user = await user_ctx.get_user()
+            file_id = user['qr_file_id'] if user else None
+        if file_id:
+            _qr_file_ids[user_id] = file_id
+            await message.answer_photo(photo=file_id, caption=caption)
+            return
         
         # Generate QR code
         qr_bytes = generate_qr_code_bytes(str(user_id))
         
         if qr_bytes:
             # Send QR code image with caption
-            await message.answer_photo(
+            sent = await message.answer_photo(
                 photo=types.BufferedInputFile(qr_bytes, filename="qr_code.jpg"),
-                caption=f"🔗 Ваша реферальная ссылка:\n\n{referral_link}\n\n"
-                       f"Поделитесь этой ссылкой с друзьями и получайте бонусы за каждую регистрацию! 🎁"
+                caption=caption
             )
+            if sent.photo:
+                _qr_file_ids[user_id] = sent.photo[-1].file_id
+                await set_qr_file_id_async(user_id, _qr_file_ids[user_id])
         else:
             # Fallback to text only
-            await message.answer(
-                f"🔗 Ваша реферальная ссылка:\n\n{referral_link}\n\n"
-                f"Поделитесь этой ссылкой с друзьями и получайте бонусы за каждую регистрацию! 🎁"
-            )
+            await message.answer(caption)
             
     except Exception as e:
         logger.error(f"Error showing referral link: {e}")
@@ -290,15 +307,13 @@ async def show_referral_link(message: types.Message):
             "Произошла ошибка при генерации реферальной ссылки. Попробуйте позже."
         )
 
-@router.message(F.text == "Посмотреть баланс")
-async def show_balance(message: types.Message):
+async def show_balance(message: types.Message, user_ctx: UserContext):
     """Show user's balance"""
     try:
         user_id = message.from_user.id
         
         # Check if user is admin - admins don't have balance
-        from handlers.admin import is_admin
-        if is_admin(user_id):
+        if user_ctx.is_admin:
             await message.answer(
                 "⚠️ Administrators do not have a balance.\n"
                 "This feature is only for regular users."
@@ -306,7 +321,7 @@ async def show_balance(message: types.Message):
             return
         
         # Check if user is approved
-        if not is_user_approved(user_id):
+        if not await user_ctx.is_approved():
             await message.answer(
                 "Ожидайте подтверждения в реферальной системе.\n"
                 "Баланс будет доступен после одобрения заявки."
@@ -314,13 +329,9 @@ async def show_balance(message: types.Message):
             return
         
         # Get balance from Google Sheets
-        from utils.sheets import get_balance
-        
-        balance = get_balance(str(user_id))
+        balance = await get_balance_async(str(user_id))
         
         # Create inline keyboard for withdrawal
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        
         keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(
@@ -342,8 +353,7 @@ async def show_balance(message: types.Message):
             "Ошибка при загрузке баланса, попробуйте позже."
         )
 
-@router.message(F.text == "Поддержка")
-async def show_support(message: types.Message):
+async def show_support(message: types.Message, user_ctx: UserContext):
     """Show support information"""
     await message.answer(
         "🆘 Поддержка Lethai\n\n"
@@ -352,68 +362,52 @@ async def show_support(message: types.Message):
         "Мы поможем вам с любыми вопросами по реферальной программе! 💬"
     )
 
-@router.message(F.text == "📊 Статистика")
-async def admin_stats_button(message: types.Message):
-    """Handle admin statistics button"""
-    from handlers.admin import is_admin
-    if not is_admin(message.from_user.id):
-        return
-    # Redirect to stats command
-    from handlers.admin import admin_stats
-    await admin_stats(message)
+# Main menu buttons mapped to their handlers
+MENU_BUTTON_DISPATCH = {
+    "Моя реферальная ссылка": show_referral_link,
+    "Посмотреть баланс": show_balance,
+    "Поддержка": show_support,
+}
 
-@router.message(F.text == "👥 Список пользователей")
-async def admin_users_button(message: types.Message):
-    """Handle admin users list button"""
-    from handlers.admin import is_admin
-    if not is_admin(message.from_user.id):
-        return
-    # Redirect to users command
-    from handlers.admin import list_users
-    await list_users(message)
+@router.message(F.text.in_(frozenset(MENU_BUTTON_DISPATCH)))
+async def menu_button(message: types.Message, user_ctx: UserContext):
+    """Handle main menu buttons"""
+    await MENU_BUTTON_DISPATCH[message.text](message, user_ctx)
 
-@router.message(F.text == "⚙️ Админ панель")
-async def admin_panel_button(message: types.Message):
-    """Handle admin panel button"""
-    from handlers.admin import is_admin
-    if not is_admin(message.from_user.id):
-        return
-    # Redirect to admin command
-    from handlers.admin import admin_panel
-    await admin_panel(message)
+# Admin keyboard buttons mapped to the admin command handlers
+ADMIN_BUTTON_DISPATCH = {
+    "📊 Статистика": admin_stats,
+    "👥 Список пользователей": list_users,
+    "⚙️ Админ панель": admin_panel,
+    "🏥 Здоровье системы": health_check,
+}
 
-@router.message(F.text == "🏥 Здоровье системы")
-async def health_check_button(message: types.Message):
-    """Handle health check button"""
-    from handlers.admin import is_admin
-    if not is_admin(message.from_user.id):
+@router.message(F.text.in_(frozenset(ADMIN_BUTTON_DISPATCH)))
+async def admin_button(message: types.Message, user_ctx: UserContext):
+    """Handle admin keyboard buttons"""
+    if not user_ctx.is_admin:
         return
-    # Redirect to health command
-    from handlers.admin import health_check
-    await health_check(message)
+    await ADMIN_BUTTON_DISPATCH[message.text](message)
 
 @router.message(F.text & ~F.text.startswith('/'))
-async def handle_other_messages(message: types.Message, state: FSMContext):
+async def handle_other_messages(message: types.Message, state: FSMContext, user_ctx: UserContext):
     """Handle other messages (excluding commands)"""
     current_state = await state.get_state()
     
-    if current_state:
+    match current_state:
         # User is in registration flow
-        if current_state == Register.phone:
+        case Register.phone.state:
             await invalid_contact(message, state)
-        elif current_state == Register.name:
+        case Register.name.state:
             await process_name(message, state)
-    else:
-        # User is not in any state, show help
-        user_id = message.from_user.id
-        user = get_user(user_id)
-        
-        if user and user['approved']:
-            await message.answer(
-                "Используйте меню ниже для навигации:",
-                reply_markup=get_main_menu_keyboard()
-            )
-        else:
-            await message.answer(
-                "Для начала работы используйте команду /start"
-            )
+        case None:
+            # User is not in any state, show help
+            if await user_ctx.is_approved():
+                await message.answer(
+                    "Используйте меню ниже для навигации:",
+                    reply_markup=MAIN_MENU_KB
+                )
+            else:
+                await message.answer(
+                    "Для начала работы используйте команду /start"
+                )
@@ -1,10 +1,14 @@
 """
 Health check utilities for the bot
 """
+import asyncio
 import logging
 import os
 import sqlite3
-from typing import Dict, Any, List
+import threading
+import time
+from functools import wraps
+from typing import Dict, Any, Callable, List, Optional, Tuple, TypedDict
 from datetime import datetime
 
 from utils.sheets import test_connection
@@ -12,14 +16,66 @@ from utils.database import get_approved_users, get_pending_users
 
 logger = logging.getLogger(__name__)
 
+DB_PATH = 'users.db'
+
+class CheckResult(TypedDict):
+    """Result of a single health check"""
+    status: str  # 'healthy' or 'error'
+    message: str
+    details: Dict[str, Any]
+
+# Read-only connection reused across health checks, opened on first use
+_conn: Optional[sqlite3.Connection] = None
+_conn_lock = threading.Lock()
+
+def _get_connection() -> sqlite3.Connection:
+    """Return the shared health-check connection (call with _conn_lock held)"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        # Health checks must never write to the database
+        _conn.execute("PRAGMA query_only = 1")
+    return _conn
+
+# Cached check results: check name -> (expires_at, result)
+HEALTH_CACHE_TTL_SHEETS = int(os.getenv('HEALTH_CACHE_TTL_SHEETS', '30'))
+HEALTH_CACHE_TTL_FS = int(os.getenv('HEALTH_CACHE_TTL_FS', '300'))
+_cache: Dict[str, Tuple[float, CheckResult]] = {}
+
+def _ttl_cache(seconds: int) -> Callable:
+    """Reuse a check's result for the given number of seconds"""
+    def decorator(fn: Callable[[], CheckResult]) -> Callable[[], CheckResult]:
+        @wraps(fn)
+        def wrapper() -> CheckResult:
+            now = time.monotonic()
+            entry = _cache.get(fn.__name__)
+            if entry and now < entry[0]:
+                return entry[1]
+            result = fn()
+            _cache[fn.__name__] = (now + seconds, result)
+            return result
+        return wrapper
+    return decorator
+
+# Report timestamp, reformatted only when the second changes: (second, iso string)
+_last_timestamp: Tuple[int, str] = (0, '')
+
+def _iso_now() -> str:
+    """Current local time in ISO format at one-second resolution"""
+    global _last_timestamp
+    second = int(time.time())
+    if second != _last_timestamp[0]:
+        _last_timestamp = (second, datetime.fromtimestamp(second).isoformat())
+    return _last_timestamp[1]
+
 class HealthChecker:
     """Health check utilities"""
     
     @staticmethod
-    def check_database() -> Dict[str, Any]:
+    def check_database() -> CheckResult:
         """Check database health"""
         try:
-            db_path = 'users.db'
+            db_path = DB_PATH
             if not os.path.exists(db_path):
                 return {
                     'status': 'error',
@@ -28,16 +84,14 @@ class HealthChecker:
                 }
             
             # Test database connection
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM users WHERE approved = 1")
-                approved_users = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM users WHERE approved = 0")
-                pending_users = cursor.fetchone()[0]
+            with _conn_lock:
+                cursor = _get_connection().execute("""
+                    SELECT COUNT(*),
+                           COALESCE(SUM(approved = 1), 0),
+                           COALESCE(SUM(approved = 0), 0)
+                    FROM users
+                """)
+                total_users, approved_users, pending_users = cursor.fetchone()
             
             return {
                 'status': 'healthy',
@@ -59,7 +113,8 @@ class HealthChecker:
             }
     
     @staticmethod
-    def check_google_sheets() -> Dict[str, Any]:
+    @_ttl_cache(HEALTH_CACHE_TTL_SHEETS)
+    def check_google_sheets() -> CheckResult:
         """Check Google Sheets connection"""
         try:
             if not os.path.exists('credentials.json'):
@@ -94,7 +149,8 @@ class HealthChecker:
             }
     
     @staticmethod
-    def check_file_system() -> Dict[str, Any]:
+    @_ttl_cache(HEALTH_CACHE_TTL_FS)
+    def check_file_system() -> CheckResult:
         """Check file system health"""
         try:
             required_files = [
@@ -107,9 +163,14 @@ class HealthChecker:
             missing_files = []
             file_sizes = {}
             
+            # One directory listing instead of exists() + getsize() per file
+            with os.scandir('.') as it:
+                entries = {entry.name: entry for entry in it}
+            
             for file_path in required_files:
-                if os.path.exists(file_path):
-                    file_sizes[file_path] = os.path.getsize(file_path)
+                entry = entries.get(file_path)
+                if entry is not None and entry.is_file():
+                    file_sizes[file_path] = entry.stat().st_size
                 else:
                     missing_files.append(file_path)
             
@@ -140,7 +201,8 @@ class HealthChecker:
             }
     
     @staticmethod
-    def check_environment() -> Dict[str, Any]:
+    @_ttl_cache(HEALTH_CACHE_TTL_FS)
+    def check_environment() -> CheckResult:
         """Check environment variables"""
         try:
             required_vars = [
@@ -186,6 +248,15 @@ class HealthChecker:
                 'details': {}
             }
     
+    @staticmethod
+    def close() -> None:
+        """Close the shared health-check database connection"""
+        global _conn
+        with _conn_lock:
+            if _conn is not None:
+                _conn.close()
+                _conn = None
+    
     @classmethod
     def run_all_checks(cls) -> Dict[str, Any]:
         """Run all health checks"""
@@ -195,22 +266,40 @@ class HealthChecker:
             'file_system': cls.check_file_system(),
             'environment': cls.check_environment()
         }
-        
-        # Determine overall status
-        overall_status = 'healthy'
-        for check_name, check_result in checks.items():
-            if check_result['status'] == 'error':
-                overall_status = 'unhealthy'
-                break
+        return cls._build_report(checks)
+    
+    @classmethod
+    async def run_all_checks_async(cls) -> Dict[str, Any]:
+        """Run all health checks concurrently in worker threads"""
+        names = ('database', 'google_sheets', 'file_system', 'environment')
+        results = await asyncio.gather(
+            asyncio.to_thread(cls.check_database),
+            asyncio.to_thread(cls.check_google_sheets),
+            asyncio.to_thread(cls.check_file_system),
+            asyncio.to_thread(cls.check_environment)
+        )
+        return cls._build_report(dict(zip(names, results)))
+    
+    @staticmethod
+    def _build_report(checks: Dict[str, CheckResult]) -> Dict[str, Any]:
+        """Combine individual check results into an overall report"""
+        # Count statuses in a single pass
+        healthy_checks = error_checks = 0
+        for check_result in checks.values():
+            status = check_result['status']
+            if status == 'healthy':
+                healthy_checks += 1
+            elif status == 'error':
+                error_checks += 1
         
         return {
-            'status': overall_status,
-            'timestamp': datetime.now().isoformat(),
+            'status': 'unhealthy' if error_checks else 'healthy',
+            'timestamp': _iso_now(),
             'checks': checks,
             'summary': {
                 'total_checks': len(checks),
-                'healthy_checks': sum(1 for c in checks.values() if c['status'] == 'healthy'),
-                'error_checks': sum(1 for c in checks.values() if c['status'] == 'error')
+                'healthy_checks': healthy_checks,
+                'error_checks': error_checks
             }
         }
     
@@ -1,4 +1,5 @@
 import os
+import shutil
 import subprocess
 import sys
 
@@ -20,30 +21,39 @@ def main():
         print(f"Ошибка при создании директории venv: {e}")
         sys.exit(1)
     
+    # Используем uv, если он установлен: он ставит пакеты параллельно и намного быстрее pip
+    uv_path = shutil.which("uv")
+    
     # Создаем виртуальное окружение
     try:
-        subprocess.run([sys.executable, "-m", "venv", venv_dir], check=True)
+        if uv_path:
+            subprocess.run([uv_path, "venv", venv_dir], check=True)
+        else:
+            subprocess.run([sys.executable, "-m", "venv", venv_dir], check=True)
     except subprocess.CalledProcessError as e:
         print(f"Ошибка при создании виртуального окружения: {e}")
         sys.exit(1)
     
-    # Определяем путь к pip в виртуальном окружении
-    if sys.platform == "darwin":  # macOS
-        pip_path = os.path.join(venv_dir, "bin", "pip")
-    else:
-        # Для других ОС (можно добавить поддержку Windows/Linux если нужно)
-        pip_path = os.path.join(venv_dir, "Scripts", "pip")
-    
-    # Обновляем pip
-    try:
-        subprocess.run([pip_path, "install", "--upgrade", "pip"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Ошибка при обновлении pip: {e}")
-        sys.exit(1)
+    # Определяем пути к python и pip в виртуальном окружении
+    if sys.platform == "win32":
+        bin_dir = os.path.join(venv_dir, "Scripts")
+    else:  # macOS и Linux
+        bin_dir = os.path.join(venv_dir, "bin")
+    python_path = os.path.join(bin_dir, "python")
+    pip_path = os.path.join(bin_dir, "pip")
     
-    # Устанавливаем библиотеки из requirements.txt
+    # Устанавливаем библиотеки из requirements.txt (одним запуском вместе с обновлением pip)
     try:
-        subprocess.run([pip_path, "install", "-r", requirements_file], check=True)
+        if uv_path:
+            subprocess.run(
+                [uv_path, "pip", "install", "--python", python_path, "-r", requirements_file],
+                check=True
+            )
+        else:
+            subprocess.run(
+                [pip_path, "install", "--upgrade", "pip", "-r", requirements_file],
+                check=True
+            )
         print(f"Все библиотеки из requirements.txt успешно установлены в {venv_dir}")
     except subprocess.CalledProcessError as e:
         print(f"Ошибка при установке библиотек: {e}")
@@ -1,12 +1,17 @@
 """
 Logging configuration for Lethai Concierge Referral Bot
 """
+import atexit
 import logging
 import logging.handlers
 import os
+import queue
 import sys
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+
+# Background listener that writes queued records to the real handlers
+_queue_listener: Optional[logging.handlers.QueueListener] = None
 
 def setup_logging(
     level: str = "INFO",
@@ -32,6 +37,13 @@ def setup_logging(
         if log_dir and not os.path.exists(log_dir):
             os.makedirs(log_dir)
     
+    global _queue_listener
+    
+    # Stop the listener from a previous setup before replacing it
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+    
     # Configure root logger
     root_logger = logging.getLogger()
     root_logger.setLevel(getattr(logging, level.upper()))
@@ -45,12 +57,15 @@ def setup_logging(
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     
+    # Real handlers are driven by the queue listener, not the root logger
+    handlers: List[logging.Handler] = []
+    
     # Console handler
     if console_output:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(getattr(logging, level.upper()))
         console_handler.setFormatter(formatter)
-        root_logger.addHandler(console_handler)
+        handlers.append(console_handler)
     
     # File handler with rotation
     if log_file:
@@ -62,7 +77,17 @@ def setup_logging(
         )
         file_handler.setLevel(getattr(logging, level.upper()))
         file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    # Log calls only enqueue records; disk and console writes happen in a
+    # background thread so they never block the event loop
+    if handlers:
+        log_queue: queue.Queue = queue.Queue(-1)
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _queue_listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        _queue_listener.start()
     
     # Set specific loggers
     logging.getLogger('aiogram').setLevel(logging.WARNING)
@@ -71,6 +96,15 @@ def setup_logging(
     logging.getLogger('urllib3').setLevel(logging.WARNING)
     logging.getLogger('PIL').setLevel(logging.WARNING)
 
+def stop_logging() -> None:
+    """Flush queued log records and stop the background listener"""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+atexit.register(stop_logging)
+
 def get_logger(name: str) -> logging.Logger:
     """
     Get a logger instance
@@ -103,6 +137,8 @@ class BotLogger:
     
     def debug(self, message: str, **kwargs):
         """Log debug message"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         self.logger.debug(message, extra=kwargs)
     
     def critical(self, message: str, **kwargs):
@@ -111,23 +147,23 @@ class BotLogger:
     
     def log_user_action(self, user_id: int, action: str, details: str = ""):
         """Log user action"""
-        self.info(f"User {user_id} performed action: {action}", 
-                 extra={'user_id': user_id, 'action': action, 'details': details})
+        self.logger.info("User %s performed action: %s", user_id, action,
+                         extra={'user_id': user_id, 'action': action, 'details': details})
     
     def log_admin_action(self, admin_id: int, action: str, target_user_id: int = None, details: str = ""):
         """Log admin action"""
-        self.info(f"Admin {admin_id} performed action: {action}", 
-                 extra={'admin_id': admin_id, 'action': action, 'target_user_id': target_user_id, 'details': details})
+        self.logger.info("Admin %s performed action: %s", admin_id, action,
+                         extra={'admin_id': admin_id, 'action': action, 'target_user_id': target_user_id, 'details': details})
     
     def log_error(self, error: Exception, context: str = ""):
         """Log error with context"""
-        self.error(f"Error in {context}: {str(error)}", 
-                  extra={'error': str(error), 'context': context, 'exception': type(error).__name__})
+        self.logger.error("Error in %s: %s", context, error,
+                          extra={'error': str(error), 'context': context, 'exception': type(error).__name__})
     
     def log_system_event(self, event: str, details: str = ""):
         """Log system event"""
-        self.info(f"System event: {event}", 
-                 extra={'event': event, 'details': details})
+        self.logger.info("System event: %s", event,
+                         extra={'event': event, 'details': details})
 
 # Initialize logging on import
 if __name__ != "__main__":
@@ -1,60 +1,107 @@
 import asyncio
 import logging
-import os
+import logging.handlers
+import queue
 import signal
 import sys
-from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.memory import SimpleEventIsolation
+
+from config import config
 
 # Import handlers
 from handlers import start, admin, menu
 
-# Import utilities
-from utils.database import init_database
-from utils.sheets import test_connection
-
-# Load environment variables
-load_dotenv()
+# Import middlewares
+from middlewares.user_context import UserContextMiddleware
+from middlewares.update_offset import UpdateOffsetMiddleware
 
-# Global shutdown flag
-shutdown_event = asyncio.Event()
+# Import utilities
+from utils.database import init_database, reset_connection
+from utils.fsm_storage import LRUMemoryStorage
+from utils.sheets import test_connection_async, warm_snapshot_async
 
 # Configure logging (stdout only for Docker compatibility)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
+# Log calls only enqueue records; a listener thread formats and writes them
+# so stdout writes never block the event loop
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
+log_listener = logging.handlers.QueueListener(log_queue, stdout_handler)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener.start()
 
 logger = logging.getLogger(__name__)
 
 # Bot configuration
-BOT_TOKEN = os.getenv('BOT_TOKEN')
+BOT_TOKEN = config.BOT_TOKEN
 if not BOT_TOKEN:
     logger.error("BOT_TOKEN not found in environment variables")
     sys.exit(1)
 
+def create_session() -> AiohttpSession:
+    """Create the Bot API HTTP session; its connection pool is reused between calls"""
+    json_options = {}
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        # Parse updates and serialize request payloads with orjson when installed
+        json_options = {
+            'json_loads': orjson.loads,
+            'json_dumps': lambda obj: orjson.dumps(obj).decode()
+        }
+    
+    return AiohttpSession(limit=100, **json_options)
+
 # Create bot and dispatcher
 bot = Bot(
     token=BOT_TOKEN,
+    session=create_session(),
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-# Use memory storage for FSM
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+def create_storage():
+    """Create FSM storage: Redis when REDIS_URL is set, otherwise bounded in-memory"""
+    if config.REDIS_URL:
+        from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+        
+        storage = RedisStorage.from_url(
+            config.REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_bot_id=True)
+        )
+        return storage, storage.create_isolation()
+    
+    return LRUMemoryStorage(), SimpleEventIsolation()
+
+# FSM storage; updates from the same chat are processed one at a time
+storage, events_isolation = create_storage()
+dp = Dispatcher(storage=storage, events_isolation=events_isolation)
+
+# Attach per-update user context to every message
+dp.message.middleware(UserContextMiddleware())
+
+# Remember the last handled update so restarts don't replay it
+offset_middleware = UpdateOffsetMiddleware(config.UPDATE_OFFSET_PATH)
+offset_middleware.install(dp)
 
 # Include routers
 dp.include_router(start.router)
 dp.include_router(admin.router)
 dp.include_router(menu.router)
 
+# Tasks started by on_startup that run alongside polling
+background_tasks: set = set()
+
 async def on_startup():
     """Bot startup tasks"""
     logger.info("Starting Lethai Concierge Referral Bot...")
@@ -67,21 +114,37 @@ async def on_startup():
         logger.error(f"Database initialization failed: {e}")
         sys.exit(1)
     
-    # Test Google Sheets connection
-    try:
-        if test_connection():
-            logger.info("Google Sheets connection successful")
-        else:
-            logger.warning("Google Sheets connection failed - check credentials")
-    except Exception as e:
-        logger.error(f"Google Sheets connection test failed: {e}")
+    # Confirm updates that were handled before the last restart
+    if offset_middleware.offset:
+        try:
+            await bot.get_updates(offset=offset_middleware.offset, limit=1, timeout=0)
+            logger.info(f"Resuming from update offset {offset_middleware.offset}")
+        except Exception as e:
+            logger.error(f"Failed to confirm saved update offset: {e}")
     
-    # Get bot info
-    try:
-        bot_info = await bot.get_me()
+    # Answer from the last saved worksheet rows while the sheet is downloaded again
+    task = asyncio.create_task(warm_snapshot_async())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    
+    # Test Google Sheets connection and get bot info concurrently
+    sheets_ok, bot_info = await asyncio.gather(
+        test_connection_async(),
+        bot.get_me(),
+        return_exceptions=True
+    )
+    
+    if isinstance(sheets_ok, Exception):
+        logger.error(f"Google Sheets connection test failed: {sheets_ok}")
+    elif sheets_ok:
+        logger.info("Google Sheets connection successful")
+    else:
+        logger.warning("Google Sheets connection failed - check credentials")
+    
+    if isinstance(bot_info, Exception):
+        logger.error(f"Failed to get bot info: {bot_info}")
+    else:
         logger.info(f"Bot started successfully: @{bot_info.username}")
-    except Exception as e:
-        logger.error(f"Failed to get bot info: {e}")
     
     logger.info("Bot startup completed")
 
@@ -89,37 +152,61 @@ async def on_shutdown():
     """Bot shutdown tasks"""
     logger.info("Shutting down bot...")
     
+    # Save the offset of updates finished since the last delayed write
+    await offset_middleware.close()
+    
     # Close bot session
     await bot.session.close()
     
-    logger.info("Bot shutdown completed")
-
-async def handle_shutdown(sig):
-    """Handle shutdown signals"""
-    logger.info(f"Received signal {sig.name}, initiating graceful shutdown...")
-    shutdown_event.set()
+    # Close the shared database connections
+    from health import HealthChecker
+    HealthChecker.close()
+    reset_connection()
     
-    # Stop the dispatcher
-    await dp.stop_polling()
+    logger.info("Bot shutdown completed")
 
 async def main():
     """Main function"""
-    # Setup signal handlers
+    # Setup signal handlers: the first SIGTERM/SIGINT resolves a single
+    # pre-created future, repeated signals are ignored
     loop = asyncio.get_running_loop()
+    shutdown_future: asyncio.Future = loop.create_future()
     
     for sig in (signal.SIGTERM, signal.SIGINT):
         loop.add_signal_handler(
             sig,
-            lambda s=sig: asyncio.create_task(handle_shutdown(s))
+            lambda s=sig: shutdown_future.done() or shutdown_future.set_result(s)
         )
     
     try:
         # Run startup tasks
         await on_startup()
         
-        # Start polling
+        # Start polling; our own signal handlers decide when it stops
         logger.info("Starting bot polling...")
-        await dp.start_polling(bot)
+        polling = asyncio.create_task(dp.start_polling(
+            bot,
+            polling_timeout=30,
+            allowed_updates=dp.resolve_used_update_types(),
+            handle_as_tasks=True,
+            handle_signals=False
+        ))
+        
+        await asyncio.wait(
+            (polling, shutdown_future),
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        
+        if shutdown_future.done():
+            logger.info(f"Received signal {shutdown_future.result().name}, initiating graceful shutdown...")
+            try:
+                await dp.stop_polling()
+            except RuntimeError:
+                # Signal arrived before polling got going
+                polling.cancel()
+                return
+        
+        await polling
         
     except Exception as e:
         logger.error(f"Bot error: {e}")
@@ -128,14 +215,23 @@ async def main():
         await on_shutdown()
         logger.info("Bot shutdown complete")
 
-if __name__ == '__main__':
+def run() -> None:
+    """Run the bot on uvloop when it is installed, otherwise on the stock loop"""
     try:
-        asyncio.run(main())
+        try:
+            import uvloop
+        except ImportError:
+            asyncio.run(main())
+        else:
+            uvloop.run(main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
         logger.error(f"Fatal error: {e}")
         sys.exit(1)
+    finally:
+        # Flush queued log records before the process exits
+        log_listener.stop()
 
-
-
+if __name__ == '__main__':
+    run()
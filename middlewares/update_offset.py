@@ -0,0 +1,111 @@
+"""
+Persist the last handled Telegram update offset between restarts
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+def load_offset(path: str) -> Optional[int]:
+    """Read the saved offset, ignoring a missing or corrupt file"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            offset = json.load(f).get('offset')
+        return offset if isinstance(offset, int) else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def save_offset(path: str, offset: int) -> None:
+    """Atomically write the offset so a crash never leaves a partial file"""
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'offset': offset}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Error saving update offset to {path}: {e}")
+
+# Finished updates are written at most once per SAVE_DELAY seconds
+SAVE_DELAY = 1.0
+
+class UpdateOffsetMiddleware(BaseMiddleware):
+    """
+    Persist the offset below which every update has finished processing.
+    
+    With handle_as_tasks updates finish out of order, so the saved offset is the
+    oldest update still in flight (or the newest seen + 1 when none is). Updates
+    enter in the order polling created their tasks only if this is the first
+    outer middleware, see install().
+    """
+    
+    def __init__(self, path: str, save_delay: float = SAVE_DELAY):
+        self.path = path
+        self.save_delay = save_delay
+        self._saved = load_offset(path) or 0
+        self._next = self._saved
+        self._in_flight: Set[int] = set()
+        self._save_task: Optional[asyncio.Task] = None
+        self._save_lock = asyncio.Lock()
+    
+    @property
+    def offset(self) -> int:
+        """Offset up to which all updates are handled"""
+        return min(self._in_flight) if self._in_flight else self._next
+    
+    def install(self, dp: Dispatcher) -> None:
+        """Register as the outermost update middleware, ahead of aiogram's own"""
+        middlewares = list(dp.update.outer_middleware)
+        for middleware in middlewares:
+            dp.update.outer_middleware.unregister(middleware)
+        dp.update.outer_middleware(self)
+        for middleware in middlewares:
+            dp.update.outer_middleware(middleware)
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        
+        update_id = event.update_id
+        self._in_flight.add(update_id)
+        self._next = max(self._next, update_id + 1)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(update_id)
+            if self._save_task is None and self.offset > self._saved:
+                self._save_task = asyncio.create_task(self._save_later())
+    
+    async def _save_later(self) -> None:
+        try:
+            await asyncio.sleep(self.save_delay)
+        finally:
+            self._save_task = None
+        await self.flush()
+    
+    async def flush(self) -> None:
+        """Write the current offset off the event loop if it moved since the last save"""
+        async with self._save_lock:
+            offset = self.offset
+            if offset > self._saved:
+                await asyncio.to_thread(save_offset, self.path, offset)
+                self._saved = offset
+    
+    async def close(self) -> None:
+        """Cancel the pending delayed write and save the offset now"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+        await self.flush()
@@ -0,0 +1,48 @@
+"""
+Per-update user context for Lethai Concierge Referral Bot handlers
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from handlers.admin import is_admin
+from utils.database import get_user_async, is_user_approved_async
+
+class UserContext:
+    """Admin status and database record of the user behind an update"""
+    
+    __slots__ = ('user_id', 'is_admin', '_user', '_loaded')
+    
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.is_admin = is_admin(user_id)
+        self._user: Optional[Dict[str, Any]] = None
+        self._loaded = False
+    
+    async def get_user(self) -> Optional[Dict[str, Any]]:
+        """Load the user record once per update"""
+        if not self._loaded:
+            self._user = await get_user_async(self.user_id)
+            self._loaded = True
+        return self._user
+    
+    async def is_approved(self) -> bool:
+        """Check approval, reusing the user record if it was already loaded"""
+        if self._loaded:
+            return bool(self._user and self._user['approved'])
+        return await is_user_approved_async(self.user_id)
+
+class UserContextMiddleware(BaseMiddleware):
+    """Attach a lazily loaded UserContext to every message as data['user_ctx']"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = getattr(event, 'from_user', None)
+        if from_user is not None:
+            data['user_ctx'] = UserContext(from_user.id)
+        return await handler(event, data)
@@ -1,58 +0,0 @@
-"""
-Setup script for Lethai Concierge Referral Bot
-"""
-from setuptools import setup, find_packages
-
-with open("README.md", "r", encoding="utf-8") as fh:
-    long_description = fh.read()
-
-with open("requirements.txt", "r", encoding="utf-8") as fh:
-    requirements = [line.strip() for line in fh if line.strip() and not line.startswith("#")]
-
-setup(
-    name="lethai-referral-bot",
-    version="1.0.0",
-    author="Lethai Concierge Services",
-    author_email="info@lethai.com",
-    description="Telegram bot for Lethai concierge referral program",
-    long_description=long_description,
-    long_description_content_type="text/markdown",
-    url="https://github.com/lethai/referral-bot",
-    packages=find_packages(),
-    classifiers=[
-        "Development Status :: 5 - Production/Stable",
-        "Intended Audience :: End Users/Desktop",
-        "License :: Other/Proprietary License",
-        "Operating System :: OS Independent",
-        "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.10",
-        "Programming Language :: Python :: 3.11",
-        "Programming Language :: Python :: 3.12",
-        "Topic :: Communications :: Chat",
-        "Topic :: Internet :: WWW/HTTP :: Dynamic Content",
-    ],
-    python_requires=">=3.10",
-    install_requires=requirements,
-    extras_require={
-        "dev": [
-            "pytest>=8.3.2",
-            "pytest-asyncio>=0.23.8",
-            "pytest-cov>=4.0.0",
-            "black>=23.0.0",
-            "flake8>=6.0.0",
-            "mypy>=1.0.0",
-        ],
-    },
-    entry_points={
-        "console_scripts": [
-            "lethai-bot=main:main",
-        ],
-    },
-    include_package_data=True,
-    package_data={
-        "": ["*.md", "*.txt", "*.yml", "*.yaml"],
-    },
-)
-
-
-
@@ -0,0 +1,62 @@
+"""
+In-memory stand-ins for external services used in tests
+"""
+from typing import List, Optional
+
+from gspread.cell import Cell
+
+class FakeWorksheet:
+    """
+    gspread.Worksheet backed by a list of rows; rows and columns are 1-based like in gspread.
+    It is also its own spreadsheet, whose revision changes with every write.
+    """
+    
+    def __init__(self, rows: Optional[List[List[str]]] = None):
+        self.rows = [list(row) for row in rows or []]
+        self.fetches = 0
+        self.appends = 0
+        self.revision = 0
+    
+    @property
+    def spreadsheet(self) -> "FakeWorksheet":
+        return self
+    
+    def get_lastUpdateTime(self) -> str:
+        return f"2026-01-01T00:00:{self.revision:02d}.000Z"
+    
+    def get_all_values(self) -> List[List[str]]:
+        self.fetches += 1
+        return [list(row) for row in self.rows]
+    
+    def get(self, range_name: Optional[str] = None) -> List[List[str]]:
+        return self.get_all_values()
+    
+    def row_values(self, row: int) -> List[str]:
+        return list(self.rows[row - 1]) if 0 < row <= len(self.rows) else []
+    
+    def cell(self, row: int, col: int) -> Cell:
+        values = self.row_values(row)
+        return Cell(row, col, values[col - 1] if col <= len(values) else "")
+    
+    def find(self, query: str, in_column: Optional[int] = None) -> Optional[Cell]:
+        for row_index, row in enumerate(self.rows, start=1):
+            for col_index, value in enumerate(row, start=1):
+                if value == query and in_column in (None, col_index):
+                    return Cell(row_index, col_index, value)
+        return None
+    
+    def append_row(self, values: List[str], **kwargs) -> None:
+        self.append_rows([values])
+    
+    def append_rows(self, values: List[List[str]], **kwargs) -> None:
+        self.appends += 1
+        self.revision += 1
+        self.rows.extend(list(row) for row in values)
+    
+    def update_cell(self, row: int, col: int, value: str) -> None:
+        self.revision += 1
+        while len(self.rows) < row:
+            self.rows.append([])
+        values = self.rows[row - 1]
+        values.extend([""] * (col - len(values)))
+        values[col - 1] = str(value)
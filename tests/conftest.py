@@ -0,0 +1,10 @@
+"""
+Shared pytest configuration
+"""
+import pytest
+
+def pytest_collection_modifyitems(config, items):
+    """Put all serial tests into one xdist group so they run on the same worker"""
+    for item in items:
+        if item.get_closest_marker("serial"):
+            item.add_marker(pytest.mark.xdist_group("serial"))
@@ -5,17 +5,35 @@ import pytest
 import sqlite3
 import os
 import tempfile
+from contextlib import contextmanager
 from unittest.mock import patch, Mock
 
 from utils.database import (
     init_database,
     save_user,
+    bulk_save_users,
     get_user,
     update_user_approval,
+    approve_pending_user,
     get_pending_users,
     get_approved_users,
+    get_user_counts,
     is_user_approved,
-    delete_user
+    is_user_approved_cached,
+    is_user_approved_async,
+    get_user_async,
+    save_user_async,
+    update_user_approval_async,
+    get_pending_users_async,
+    get_approved_users_async,
+    get_user_counts_async,
+    delete_user_async,
+    invalidate_user_cache,
+    reset_connection,
+    delete_user,
+    set_qr_file_id,
+    SQL_PENDING,
+    SQL_APPROVED,
 )
 
 class TestDatabaseInitialization:
@@ -39,7 +57,40 @@ class TestDatabaseInitialization:
                     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
                     result = cursor.fetchone()
                     assert result is not None
+                conn.close()
         finally:
+            reset_connection()
+            if os.path.exists(db_path):
+                os.unlink(db_path)
+    
+    def test_init_database_adds_missing_columns(self):
+        """Test that an existing users table gains columns added later"""
+        with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as tmp:
+            db_path = tmp.name
+        
+        try:
+            with sqlite3.connect(db_path) as conn:
+                conn.execute("""
+                    CREATE TABLE users (
+                        telegram_id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        phone TEXT NOT NULL,
+                        approved BOOLEAN DEFAULT FALSE,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        approved_at TIMESTAMP NULL
+                    )
+                """)
+                conn.execute("INSERT INTO users (telegram_id, name, phone) VALUES (1, 'Old', '+1')")
+            conn.close()
+            
+            with patch('utils.database.DATABASE_PATH', db_path):
+                init_database()
+                
+                user = get_user(1)
+                assert user['name'] == 'Old'
+                assert user['qr_file_id'] is None
+        finally:
+            reset_connection()
             if os.path.exists(db_path):
                 os.unlink(db_path)
     
@@ -62,6 +113,7 @@ class TestUserOperations:
             init_database()
             yield db_path
         
+        reset_connection()
         if os.path.exists(db_path):
             os.unlink(db_path)
     
@@ -136,13 +188,47 @@ class TestUserOperations:
             
             assert result is False
     
+    def test_approve_pending_user(self, temp_db):
+        """Test approving a pending user returns the updated row"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", False)
+            
+            user = approve_pending_user(12345)
+            
+            assert user['telegram_id'] == 12345
+            assert user['name'] == "Test User"
+            assert user['approved']
+            assert user['approved_at'] is not None
+            assert is_user_approved(12345) is True
+            
+            # Already approved and unknown users are not updated
+            assert approve_pending_user(12345) is None
+            assert approve_pending_user(99999) is None
+    
+    def test_bulk_save_users(self, temp_db):
+        """Test saving several users in one transaction"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "User 1", "+1111111111", False)
+            
+            inserted = bulk_save_users([
+                (12345, "Duplicate", "+0000000000", True),
+                (12346, "User 2", "+2222222222", True),
+                (12347, "User 3", "+3333333333", False),
+            ])
+            
+            assert inserted == 2
+            assert get_user(12345)['name'] == "User 1"
+            assert get_user_counts() == {'pending': 2, 'approved': 1}
+    
     def test_get_pending_users(self, temp_db):
         """Test getting pending users"""
         with patch('utils.database.DATABASE_PATH', temp_db):
             # Save multiple users with different approval statuses
-            save_user(12345, "User 1", "+1111111111", False)
-            save_user(12346, "User 2", "+2222222222", True)
-            save_user(12347, "User 3", "+3333333333", False)
+            bulk_save_users([
+                (12345, "User 1", "+1111111111", False),
+                (12346, "User 2", "+2222222222", True),
+                (12347, "User 3", "+3333333333", False),
+            ])
             
             pending_users = get_pending_users()
             
@@ -151,13 +237,29 @@ class TestUserOperations:
             assert any(user['telegram_id'] == 12345 for user in pending_users)
             assert any(user['telegram_id'] == 12347 for user in pending_users)
     
+    def test_get_pending_users_limit_offset(self, temp_db):
+        """Test paging through pending users"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "User 1", "+1111111111", False)
+            save_user(12346, "User 2", "+2222222222", False)
+            save_user(12347, "User 3", "+3333333333", False)
+            
+            first_page = get_pending_users(limit=2)
+            second_page = get_pending_users(limit=2, offset=2)
+            
+            assert len(first_page) == 2
+            assert len(second_page) == 1
+            assert {user['telegram_id'] for user in first_page + second_page} == {12345, 12346, 12347}
+    
     def test_get_approved_users(self, temp_db):
         """Test getting approved users"""
         with patch('utils.database.DATABASE_PATH', temp_db):
             # Save multiple users with different approval statuses
-            save_user(12345, "User 1", "+1111111111", False)
-            save_user(12346, "User 2", "+2222222222", True)
-            save_user(12347, "User 3", "+3333333333", True)
+            bulk_save_users([
+                (12345, "User 1", "+1111111111", False),
+                (12346, "User 2", "+2222222222", True),
+                (12347, "User 3", "+3333333333", True),
+            ])
             
             approved_users = get_approved_users()
             
@@ -166,6 +268,51 @@ class TestUserOperations:
             assert any(user['telegram_id'] == 12346 for user in approved_users)
             assert any(user['telegram_id'] == 12347 for user in approved_users)
     
+    def test_listing_queries_use_indexes(self, temp_db):
+        """Test that user listings are served by an index range scan without sorting"""
+        with sqlite3.connect(temp_db) as conn:
+            plans = {
+                name: " ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+                for name, sql, params in [
+                    ('pending', SQL_PENDING, (5, 0)),
+                    ('approved', SQL_APPROVED, (5,)),
+                ]
+            }
+        conn.close()
+        
+        assert "USING INDEX idx_users_approved_created" in plans['pending']
+        assert "USING INDEX idx_users_approved_approved_at" in plans['approved']
+        assert not any("TEMP B-TREE" in plan for plan in plans.values())
+    
+    def test_get_approved_users_limit(self, temp_db):
+        """Test limiting the number of approved users returned"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "User 1", "+1111111111", True)
+            save_user(12346, "User 2", "+2222222222", True)
+            save_user(12347, "User 3", "+3333333333", True)
+            
+            approved_users = get_approved_users(limit=2)
+            
+            assert len(approved_users) == 2
+    
+    def test_get_user_counts(self, temp_db):
+        """Test counting users by approval status"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "User 1", "+1111111111", False)
+            save_user(12346, "User 2", "+2222222222", True)
+            save_user(12347, "User 3", "+3333333333", False)
+            
+            counts = get_user_counts()
+            
+            assert counts == {'pending': 2, 'approved': 1}
+    
+    def test_get_user_counts_empty(self, temp_db):
+        """Test counting users in empty database"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            counts = get_user_counts()
+            
+            assert counts == {'pending': 0, 'approved': 0}
+    
     def test_is_user_approved_true(self, temp_db):
         """Test checking approved user"""
         with patch('utils.database.DATABASE_PATH', temp_db):
@@ -191,6 +338,146 @@ class TestUserOperations:
             
             assert result is False
     
+    def test_is_user_approved_cached(self, temp_db):
+        """Test cached approval check follows approval updates and deletion"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", False)
+            
+            assert not is_user_approved_cached(12345)
+            
+            # Writes through the database module drop the cached entry
+            update_user_approval(12345, True)
+            assert is_user_approved_cached(12345)
+            
+            delete_user(12345)
+            assert not is_user_approved_cached(12345)
+            
+            invalidate_user_cache(12345)
+    
+    def test_is_user_approved_cached_approval_during_read(self, temp_db):
+        """Test that an approval landing during a slow read is not hidden by the stale result"""
+        def slow_read(telegram_id):
+            # An admin approves the user after the database read, before the result is cached
+            approved = is_user_approved(telegram_id)
+            update_user_approval(telegram_id, True)
+            return approved
+        
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", False)
+            
+            with patch('utils.database.is_user_approved', side_effect=slow_read):
+                assert not is_user_approved_cached(12345)
+            assert is_user_approved_cached(12345)
+            
+            invalidate_user_cache(12345)
+    
+    @pytest.mark.asyncio
+    async def test_is_user_approved_async_approval_during_read(self, temp_db):
+        """Test that the async check does not re-cache a result read before an approval"""
+        def slow_read(telegram_id):
+            approved = is_user_approved(telegram_id)
+            update_user_approval(telegram_id, True)
+            return approved
+        
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", False)
+            invalidate_user_cache(12345)
+            
+            with patch('utils.database.is_user_approved', side_effect=slow_read):
+                assert not await is_user_approved_async(12345)
+            assert await is_user_approved_async(12345)
+            
+            invalidate_user_cache(12345)
+    
+    def test_get_user_cached(self, temp_db):
+        """Test get_user serves repeated lookups from the cache and follows writes"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            assert get_user(12345) is None
+            save_user(12345, "Test User", "+1234567890", False)
+            
+            user = get_user(12345)
+            assert user['name'] == "Test User"
+            
+            # The returned dict is a copy of the cached entry
+            user['name'] = "Changed"
+            assert get_user(12345)['name'] == "Test User"
+            
+            # Repeated lookups do not query the database
+            with patch('utils.database._connection', side_effect=AssertionError("cache miss")):
+                assert get_user(12345)['approved'] == 0
+            
+            update_user_approval(12345, True)
+            assert get_user(12345)['approved'] == 1
+            
+            delete_user(12345)
+            assert get_user(12345) is None
+    
+    def test_get_user_write_during_read(self, temp_db):
+        """Test that a write landing between the read and the cache store is not hidden"""
+        from utils import database
+        connection = database._connection
+        
+        @contextmanager
+        def read_then_write():
+            with connection() as conn:
+                yield conn
+            # set_qr_file_id commits and clears the entry before get_user stores its row
+            with patch('utils.database._connection', connection):
+                set_qr_file_id(12345, "file-id")
+        
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", False)
+            invalidate_user_cache(12345)
+            
+            with patch('utils.database._connection', read_then_write):
+                assert get_user(12345)['qr_file_id'] is None
+            assert get_user(12345)['qr_file_id'] == "file-id"
+            
+            invalidate_user_cache(12345)
+    
+    @pytest.mark.asyncio
+    async def test_async_lookups(self, temp_db):
+        """Test async user lookup and approval check"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", True)
+            invalidate_user_cache(12345)
+            
+            user = await get_user_async(12345)
+            assert user['name'] == "Test User"
+            assert await get_user_async(99999) is None
+            assert await is_user_approved_async(12345)
+            
+            invalidate_user_cache(12345)
+    
+    @pytest.mark.asyncio
+    async def test_async_writes(self, temp_db):
+        """Test async save, approval, listing and deletion"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            assert await save_user_async(12345, "User 1", "+1111111111")
+            assert await save_user_async(67890, "User 2", "+2222222222")
+            assert not await save_user_async(12345, "Duplicate", "+3333333333")
+            
+            assert await update_user_approval_async(12345, True)
+            
+            pending = await get_pending_users_async()
+            approved = await get_approved_users_async()
+            assert [u['telegram_id'] for u in pending] == [67890]
+            assert [u['telegram_id'] for u in approved] == [12345]
+            assert await get_user_counts_async() == {'pending': 1, 'approved': 1}
+            
+            assert await delete_user_async(67890)
+            assert not await delete_user_async(67890)
+    
+    def test_set_qr_file_id(self, temp_db):
+        """Test storing the uploaded QR code file_id"""
+        with patch('utils.database.DATABASE_PATH', temp_db):
+            save_user(12345, "Test User", "+1234567890", True)
+            
+            assert get_user(12345)['qr_file_id'] is None
+            assert set_qr_file_id(12345, "AgACAgIAAxkBAAI")
+            assert get_user(12345)['qr_file_id'] == "AgACAgIAAxkBAAI"
+            assert not set_qr_file_id(99999, "AgACAgIAAxkBAAI")
+    
     def test_delete_user_success(self, temp_db):
         """Test successful user deletion"""
         with patch('utils.database.DATABASE_PATH', temp_db):
@@ -250,6 +537,13 @@ class TestErrorHandling:
             users = get_approved_users()
             
             assert users == []
+    
+    def test_get_user_counts_database_error(self):
+        """Test counting users with database error"""
+        with patch('utils.database.DATABASE_PATH', '/invalid/path/database.db'):
+            counts = get_user_counts()
+            
+            assert counts == {'pending': 0, 'approved': 0}
 
 class TestDataIntegrity:
     """Test data integrity and edge cases"""
@@ -264,6 +558,7 @@ class TestDataIntegrity:
             init_database()
             yield db_path
         
+        reset_connection()
         if os.path.exists(db_path):
             os.unlink(db_path)
     
@@ -302,9 +597,11 @@ class TestDataIntegrity:
         """Test that users are returned in correct order"""
         with patch('utils.database.DATABASE_PATH', temp_db):
             # Save users in specific order
-            save_user(12345, "User 1", "+1111111111", False)
-            save_user(12346, "User 2", "+2222222222", False)
-            save_user(12347, "User 3", "+3333333333", False)
+            bulk_save_users([
+                (12345, "User 1", "+1111111111", False),
+                (12346, "User 2", "+2222222222", False),
+                (12347, "User 3", "+3333333333", False),
+            ])
             
             pending_users = get_pending_users()
             
@@ -0,0 +1,44 @@
+"""
+Unit tests for the bounded FSM storage
+"""
+import pytest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from utils.fsm_storage import LRUMemoryStorage
+
+def make_key(user_id: int) -> StorageKey:
+    """Build a storage key for a private chat with the user"""
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+class TestLRUMemoryStorage:
+    """Test LRU-bounded memory storage"""
+    
+    @pytest.mark.asyncio
+    async def test_state_and_data_roundtrip(self):
+        """Test that state and data are stored like in MemoryStorage"""
+        storage = LRUMemoryStorage(max_size=10)
+        key = make_key(1)
+        
+        await storage.set_state(key, "Register:phone")
+        await storage.set_data(key, {'phone': '+1234567890'})
+        
+        assert await storage.get_state(key) == "Register:phone"
+        assert await storage.get_data(key) == {'phone': '+1234567890'}
+    
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used(self):
+        """Test that the oldest untouched record is evicted when full"""
+        storage = LRUMemoryStorage(max_size=2)
+        
+        await storage.set_state(make_key(1), "Register:phone")
+        await storage.set_state(make_key(2), "Register:phone")
+        
+        # Touch user 1 so user 2 becomes the least recently used
+        assert await storage.get_state(make_key(1)) == "Register:phone"
+        await storage.set_state(make_key(3), "Register:name")
+        
+        assert len(storage.storage) == 2
+        assert make_key(2) not in storage.storage
+        assert await storage.get_state(make_key(1)) == "Register:phone"
+        assert await storage.get_state(make_key(3)) == "Register:name"
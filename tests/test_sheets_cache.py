@@ -0,0 +1,85 @@
+"""
+Unit tests for the on-disk worksheet cache
+"""
+import pytest
+from unittest.mock import Mock, patch
+
+from tests._fakes import FakeWorksheet
+from utils import sheets
+from utils.sheets_cache import load_rows, save_rows
+
+# Tests share the module's client, snapshot and cache globals
+pytestmark = pytest.mark.serial
+
+ROWS = [
+    ['partnercode', 'name', 'amount'],
+    ['12345', 'Test User', '100.50'],
+]
+
+class TestSheetsCache:
+    """Test saving and loading worksheet rows"""
+    
+    def test_rows_roundtrip(self, tmp_path):
+        """Test that saved rows are read back after reopening the file"""
+        path = str(tmp_path / 'state' / 'sheets_cache.db')
+        
+        save_rows(path, 'sheet', 'rev-1', ROWS)
+        
+        assert load_rows(path, 'sheet') == ('rev-1', ROWS)
+        assert load_rows(path, 'other') is None
+    
+    def test_missing_file(self, tmp_path):
+        """Test that a missing cache file is not created by a read"""
+        path = tmp_path / 'sheets_cache.db'
+        
+        assert load_rows(str(path), 'sheet') is None
+        assert not path.exists()
+    
+    def test_saved_snapshot_served_after_restart(self, tmp_path):
+        """Test that rows saved by one run answer lookups of the next without a download"""
+        worksheet = FakeWorksheet(ROWS)
+        
+        with patch.object(sheets, 'SHEETS_CACHE_PATH', str(tmp_path / 'sheets_cache.db')), \
+             patch('utils.sheets._open_worksheet', return_value=worksheet):
+            sheets._invalidate_cache()
+            assert sheets._find_row('12345') == ROWS[1]
+            
+            # Simulate a restart: the in-memory snapshot is gone
+            sheets._invalidate_cache()
+            assert sheets._load_saved_snapshot()
+            assert sheets._find_row('12345') == ROWS[1]
+            sheets._invalidate_cache()
+        
+        assert worksheet.fetches == 1
+    
+    def test_saved_snapshot_of_old_revision(self, tmp_path):
+        """Test that saved rows are downloaded again if the sheet changed while the bot was down"""
+        worksheet = FakeWorksheet(ROWS)
+        
+        with patch.object(sheets, 'SHEETS_CACHE_PATH', str(tmp_path / 'sheets_cache.db')), \
+             patch('utils.sheets._open_worksheet', return_value=worksheet):
+            sheets._invalidate_cache()
+            sheets._find_row('12345')
+            
+            sheets._invalidate_cache()
+            worksheet.update_cell(2, 3, '200')
+            assert sheets._load_saved_snapshot()
+            assert sheets._find_row('12345') == ['12345', 'Test User', '200']
+            sheets._invalidate_cache()
+        
+        assert worksheet.fetches == 2
+    
+    def test_revision_unavailable(self, tmp_path):
+        """Test that without a revision the rows are still served but not saved"""
+        worksheet = Mock()
+        worksheet.get_all_values.return_value = ROWS
+        worksheet.spreadsheet.get_lastUpdateTime.side_effect = Exception("Drive API disabled")
+        path = str(tmp_path / 'sheets_cache.db')
+        
+        with patch.object(sheets, 'SHEETS_CACHE_PATH', path), \
+             patch('utils.sheets._open_worksheet', return_value=worksheet):
+            sheets._invalidate_cache()
+            assert sheets._find_row('12345') == ROWS[1]
+            sheets._invalidate_cache()
+        
+        assert load_rows(path, sheets._cache_key()) is None
@@ -0,0 +1,76 @@
+"""
+Unit tests for the update offset middleware
+"""
+import asyncio
+import pytest
+from unittest.mock import Mock
+
+from aiogram.types import Update
+
+from middlewares.update_offset import UpdateOffsetMiddleware, load_offset, save_offset
+
+class TestOffsetFile:
+    """Test reading and writing the offset file"""
+    
+    def test_offset_roundtrip(self, tmp_path):
+        """Test that a saved offset is read back"""
+        path = str(tmp_path / 'state' / 'offset.json')
+        
+        save_offset(path, 42)
+        
+        assert load_offset(path) == 42
+    
+    def test_corrupt_file(self, tmp_path):
+        """Test that a corrupt file is treated as no offset"""
+        path = tmp_path / 'offset.json'
+        path.write_text('not json')
+        
+        assert load_offset(str(path)) is None
+
+class TestUpdateOffsetMiddleware:
+    """Test which offset the middleware persists"""
+    
+    async def test_out_of_order_completion(self, tmp_path):
+        """Test that a finished update never moves the offset past one still running"""
+        path = str(tmp_path / 'offset.json')
+        middleware = UpdateOffsetMiddleware(path, save_delay=0)
+        release = {10: asyncio.Event(), 11: asyncio.Event()}
+        
+        async def handler(event, data):
+            await release[event.update_id].wait()
+        
+        first = asyncio.create_task(middleware(handler, Update(update_id=10), {}))
+        second = asyncio.create_task(middleware(handler, Update(update_id=11), {}))
+        await asyncio.sleep(0)
+        
+        release[11].set()
+        await second
+        await middleware.close()
+        assert middleware.offset == 10
+        assert load_offset(path) == 10
+        
+        release[10].set()
+        await first
+        await middleware.close()
+        assert middleware.offset == 12
+        assert load_offset(path) == 12
+    
+    async def test_writes_are_debounced(self, tmp_path):
+        """Test that updates finishing together share one delayed write"""
+        path = str(tmp_path / 'offset.json')
+        middleware = UpdateOffsetMiddleware(path, save_delay=60)
+        handler = Mock(side_effect=lambda event, data: asyncio.sleep(0))
+        
+        for update_id in range(5):
+            await middleware(handler, Update(update_id=update_id), {})
+        
+        assert load_offset(path) is None
+        await middleware.close()
+        assert load_offset(path) == 5
+    
+    async def test_resumes_from_saved_offset(self, tmp_path):
+        """Test that the saved offset is picked up on startup"""
+        path = str(tmp_path / 'offset.json')
+        save_offset(path, 100)
+        
+        assert UpdateOffsetMiddleware(path).offset == 100
@@ -1,19 +1,149 @@
 """
 Database utilities for SQLite operations
 """
+import asyncio
 import sqlite3
 import logging
-from typing import Optional, List, Dict, Any
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
 from datetime import datetime
 
+from cachetools import TTLCache
+
 logger = logging.getLogger(__name__)
 
 DATABASE_PATH = "users.db"
 
+# Statement text shared by every call so the connection's statement cache
+# reuses the prepared statement instead of parsing SQL again
+SQL_SAVE = """
+    INSERT OR IGNORE INTO users (telegram_id, name, phone, approved)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_GET = """
+    SELECT telegram_id, name, phone, approved, created_at, approved_at, qr_file_id
+    FROM users WHERE telegram_id = ?
+"""
+SQL_UPDATE_APPROVAL = """
+    UPDATE users 
+    SET approved = ?, approved_at = ?
+    WHERE telegram_id = ?
+"""
+SQL_APPROVE_PENDING = """
+    UPDATE users 
+    SET approved = TRUE, approved_at = ?
+    WHERE telegram_id = ? AND approved = FALSE
+    RETURNING telegram_id, name, phone, approved, approved_at
+"""
+SQL_PENDING = """
+    SELECT telegram_id, name, phone, created_at
+    FROM users 
+    WHERE approved = FALSE
+    ORDER BY created_at ASC
+    LIMIT ? OFFSET ?
+"""
+SQL_APPROVED = """
+    SELECT telegram_id, name, phone, approved_at
+    FROM users 
+    WHERE approved = TRUE
+    ORDER BY approved_at ASC
+    LIMIT ?
+"""
+SQL_COUNTS = "SELECT approved, COUNT(*) FROM users GROUP BY approved"
+SQL_IS_APPROVED = "SELECT approved FROM users WHERE telegram_id = ?"
+SQL_DELETE = "DELETE FROM users WHERE telegram_id = ?"
+SQL_SET_QR_FILE_ID = "UPDATE users SET qr_file_id = ? WHERE telegram_id = ?"
+
+# One shared connection per process (WAL mode), serialized by a lock so it
+# can be used from worker threads as well as the event loop
+_conn: Optional[sqlite3.Connection] = None
+_conn_path: Optional[str] = None
+_lock = threading.RLock()
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    """Open and tune a connection to the database file"""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    # WAL + synchronous=NORMAL: one fsync per checkpoint instead of two per commit.
+    # A power loss (not an application crash) can drop commits made since the
+    # last checkpoint; the database itself stays consistent.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")  # up to 64 MB of pages, kept for the connection's lifetime
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+@contextmanager
+def _connection() -> Iterator[sqlite3.Connection]:
+    """Hold the lock and yield the shared connection, reopening it if DATABASE_PATH changed"""
+    global _conn, _conn_path
+    with _lock:
+        if _conn is None or _conn_path != DATABASE_PATH:
+            reset_connection()
+            # Cached users belong to the previous database file
+            _clear_user_caches()
+            _conn = _open_connection(DATABASE_PATH)
+            _conn_path = DATABASE_PATH
+        yield _conn
+
+def reset_connection() -> None:
+    """Close the shared connection; the next query opens a new one"""
+    global _conn, _conn_path
+    with _lock:
+        if _conn is not None:
+            try:
+                # Refresh planner statistics for the listing indexes before closing
+                _conn.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.error(f"Error optimizing database: {e}")
+            try:
+                _conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing database connection: {e}")
+        _conn = None
+        _conn_path = None
+
+# Approval status cache for hot handler paths: telegram_id -> approved
+_approval_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+
+# get_user results (None for unknown users): telegram_id -> user dict
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+# TTLCache is not thread-safe and both caches are used from the event loop and
+# from worker threads, so every access to either is guarded by _cache_lock
+_cache_lock = threading.Lock()
+_MISSING = object()
+
+# Bumped by every invalidation; a value read from the database is cached only if
+# no invalidation happened since the read started, so a write that lands between
+# the read and the store cannot be overwritten by the stale value
+_cache_version = 0
+
+def _cache_lookup(cache: TTLCache, telegram_id: int) -> Tuple[Any, int]:
+    """Get the cached value (_MISSING if absent) and the current cache version"""
+    with _cache_lock:
+        return cache.get(telegram_id, _MISSING), _cache_version
+
+def _cache_store(cache: TTLCache, telegram_id: int, value: Any, version: int) -> None:
+    """Cache a value read from the database unless the cache was invalidated since version"""
+    with _cache_lock:
+        if _cache_version == version:
+            cache[telegram_id] = value
+
+def _clear_user_caches() -> None:
+    """Forget every cached user record and approval status"""
+    global _cache_version
+    with _cache_lock:
+        _cache_version += 1
+        _approval_cache.clear()
+        _user_cache.clear()
+
 def init_database():
     """Initialize the database and create tables if they don't exist"""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with _connection() as conn:
             cursor = conn.cursor()
             
             # Create users table
@@ -24,11 +154,26 @@ def init_database():
                     phone TEXT NOT NULL,
                     approved BOOLEAN DEFAULT FALSE,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    approved_at TIMESTAMP NULL
+                    approved_at TIMESTAMP NULL,
+                    qr_file_id TEXT NULL
                 )
             """)
             
-            conn.commit()
+            # Add columns introduced after the table was first created
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+            if 'qr_file_id' not in columns:
+                cursor.execute("ALTER TABLE users ADD COLUMN qr_file_id TEXT NULL")
+            
+            # Serve pending/approved listings ordered by date without a full scan
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_approved_created
+                ON users (approved, created_at)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_approved_approved_at
+                ON users (approved, approved_at)
+            """)
+            
             logger.info("Database initialized successfully")
             
     except sqlite3.Error as e:
@@ -49,22 +194,14 @@ def save_user(telegram_id: int, name: str, phone: str, approved: bool = False) -
         bool: True if successful, False otherwise
     """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # Check if user already exists
-            cursor.execute("SELECT telegram_id FROM users WHERE telegram_id = ?", (telegram_id,))
-            if cursor.fetchone():
+        with _connection() as conn:
+            # Existing users are ignored by the insert itself, no separate lookup
+            cursor = conn.execute(SQL_SAVE, (telegram_id, name, phone, approved))
+            if cursor.rowcount == 0:
                 logger.warning(f"User {telegram_id} already exists")
                 return False
+            invalidate_user_cache(telegram_id)
             
-            # Insert new user
-            cursor.execute("""
-                INSERT INTO users (telegram_id, name, phone, approved)
-                VALUES (?, ?, ?, ?)
-            """, (telegram_id, name, phone, approved))
-            
-            conn.commit()
             logger.info(f"User {telegram_id} saved successfully")
             return True
             
@@ -72,34 +209,76 @@ def save_user(telegram_id: int, name: str, phone: str, approved: bool = False) -
         logger.error(f"Error saving user {telegram_id}: {e}")
         return False
 
-def get_user(telegram_id: int) -> Optional[Dict[str, Any]]:
+def bulk_save_users(rows: Iterable[Tuple[int, str, str, bool]]) -> int:
     """
-    Get user information by Telegram ID
+    Save several users in a single transaction, skipping existing ones
     
     Args:
-        telegram_id: User's Telegram ID
+        rows: (telegram_id, name, phone, approved) tuples
     
     Returns:
-        dict: User information or None if not found
+        int: Number of users inserted
     """
+    rows = list(rows)
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with _connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT telegram_id, name, phone, approved, created_at, approved_at
-                FROM users WHERE telegram_id = ?
-            """, (telegram_id,))
+            # IMMEDIATE takes the write lock up front, so the batch cannot fail
+            # halfway with SQLITE_BUSY while another writer commits
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.executemany(SQL_SAVE, rows)
+                inserted = cursor.rowcount
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
             
-            row = cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+            for row in rows:
+                invalidate_user_cache(row[0])
+            
+            logger.info(f"Saved {inserted} of {len(rows)} users in bulk")
+            return inserted
             
     except sqlite3.Error as e:
-        logger.error(f"Error getting user {telegram_id}: {e}")
-        return None
+        logger.error(f"Error saving users in bulk: {e}")
+        return 0
+
+async def bulk_save_users_async(rows: Iterable[Tuple[int, str, str, bool]]) -> int:
+    """Save several users in a single transaction (async version)"""
+    return await asyncio.to_thread(bulk_save_users, list(rows))
+
+async def save_user_async(telegram_id: int, name: str, phone: str, approved: bool = False) -> bool:
+    """Save a new user to the database (async version)"""
+    return await asyncio.to_thread(save_user, telegram_id, name, phone, approved)
+
+def get_user(telegram_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Get user information by Telegram ID
+    
+    Args:
+        telegram_id: User's Telegram ID
+    
+    Returns:
+        dict: User information or None if not found
+    """
+    user, version = _cache_lookup(_user_cache, telegram_id)
+    if user is _MISSING:
+        try:
+            with _connection() as conn:
+                row = conn.execute(SQL_GET, (telegram_id,)).fetchone()
+                user = dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting user {telegram_id}: {e}")
+            return None
+        _cache_store(_user_cache, telegram_id, user, version)
+    # Callers get their own copy, so editing it cannot change the cached entry
+    return dict(user) if user is not None else None
+
+async def get_user_async(telegram_id: int) -> Optional[Dict[str, Any]]:
+    """Get user information by Telegram ID (async version)"""
+    return await asyncio.to_thread(get_user, telegram_id)
 
 def update_user_approval(telegram_id: int, approved: bool) -> bool:
     """
@@ -113,22 +292,18 @@ def update_user_approval(telegram_id: int, approved: bool) -> bool:
         bool: True if successful, False otherwise
     """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with _connection() as conn:
             cursor = conn.cursor()
             
             approved_at = datetime.now().isoformat() if approved else None
             
-            cursor.execute("""
-                UPDATE users 
-                SET approved = ?, approved_at = ?
-                WHERE telegram_id = ?
-            """, (approved, approved_at, telegram_id))
+            cursor.execute(SQL_UPDATE_APPROVAL, (approved, approved_at, telegram_id))
             
             if cursor.rowcount == 0:
                 logger.warning(f"User {telegram_id} not found for approval update")
                 return False
             
-            conn.commit()
+            invalidate_user_cache(telegram_id)
             logger.info(f"User {telegram_id} approval status updated to {approved}")
             return True
             
@@ -136,58 +311,153 @@ def update_user_approval(telegram_id: int, approved: bool) -> bool:
         logger.error(f"Error updating user {telegram_id} approval: {e}")
         return False
 
-def get_pending_users() -> List[Dict[str, Any]]:
+async def update_user_approval_async(telegram_id: int, approved: bool) -> bool:
+    """Update user approval status (async version)"""
+    return await asyncio.to_thread(update_user_approval, telegram_id, approved)
+
+def approve_pending_user(telegram_id: int) -> Optional[Dict[str, Any]]:
     """
-    Get all users pending approval
+    Approve a pending user and return the updated row in one statement
+    
+    Args:
+        telegram_id: User's Telegram ID
+    
+    Returns:
+        dict: Approved user's information, or None if the user does not
+        exist, is already approved, or the update failed
+    """
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(SQL_APPROVE_PENDING, (datetime.now().isoformat(), telegram_id))
+            rows = cursor.fetchall()
+            
+            if not rows:
+                logger.warning(f"User {telegram_id} not found or already approved")
+                return None
+            
+            invalidate_user_cache(telegram_id)
+            logger.info(f"User {telegram_id} approval status updated to True")
+            return dict(rows[0])
+            
+    except sqlite3.Error as e:
+        logger.error(f"Error approving user {telegram_id}: {e}")
+        return None
+
+async def approve_pending_user_async(telegram_id: int) -> Optional[Dict[str, Any]]:
+    """Approve a pending user and return the updated row (async version)"""
+    return await asyncio.to_thread(approve_pending_user, telegram_id)
+
+def set_qr_file_id(telegram_id: int, file_id: str) -> bool:
+    """
+    Remember the Telegram file_id of the user's uploaded QR code
+    
+    Args:
+        telegram_id: User's Telegram ID
+        file_id: Telegram file_id of the QR code photo
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(SQL_SET_QR_FILE_ID, (file_id, telegram_id))
+            invalidate_user_cache(telegram_id)
+            
+            return cursor.rowcount > 0
+            
+    except sqlite3.Error as e:
+        logger.error(f"Error saving QR file_id for user {telegram_id}: {e}")
+        return False
+
+async def set_qr_file_id_async(telegram_id: int, file_id: str) -> bool:
+    """Remember the Telegram file_id of the user's uploaded QR code (async version)"""
+    return await asyncio.to_thread(set_qr_file_id, telegram_id, file_id)
+
+def get_pending_users(limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Get users pending approval, oldest first
+    
+    Args:
+        limit: Maximum number of users to return (all if None)
+        offset: Number of users to skip
     
     Returns:
         list: List of pending users
     """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with _connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT telegram_id, name, phone, created_at
-                FROM users 
-                WHERE approved = FALSE
-                ORDER BY created_at ASC
-            """)
+            cursor.execute(SQL_PENDING, (-1 if limit is None else limit, offset))
             
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            # Build dicts straight from the cursor instead of a fetchall() list first
+            return [dict(row) for row in cursor]
             
     except sqlite3.Error as e:
         logger.error(f"Error getting pending users: {e}")
         return []
 
-def get_approved_users() -> List[Dict[str, Any]]:
+async def get_pending_users_async(limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """Get users pending approval, oldest first (async version)"""
+    return await asyncio.to_thread(get_pending_users, limit, offset)
+
+def get_approved_users(limit: Optional[int] = None) -> List[Dict[str, Any]]:
     """
-    Get all approved users
+    Get approved users
+    
+    Args:
+        limit: Maximum number of users to return (all if None)
     
     Returns:
         list: List of approved users
     """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        with _connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT telegram_id, name, phone, approved_at
-                FROM users 
-                WHERE approved = TRUE
-                ORDER BY approved_at ASC
-            """)
+            cursor.execute(SQL_APPROVED, (-1 if limit is None else limit,))
             
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            # Build dicts straight from the cursor instead of a fetchall() list first
+            return [dict(row) for row in cursor]
             
     except sqlite3.Error as e:
         logger.error(f"Error getting approved users: {e}")
         return []
 
+async def get_approved_users_async(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get approved users (async version)"""
+    return await asyncio.to_thread(get_approved_users, limit)
+
+def get_user_counts() -> Dict[str, int]:
+    """
+    Count users by approval status without loading their rows
+    
+    Returns:
+        dict: Number of 'pending' and 'approved' users
+    """
+    counts = {'pending': 0, 'approved': 0}
+    try:
+        with _connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(SQL_COUNTS)
+            
+            for approved, count in cursor.fetchall():
+                counts['approved' if approved else 'pending'] += count
+                
+    except sqlite3.Error as e:
+        logger.error(f"Error counting users: {e}")
+        
+    return counts
+
+async def get_user_counts_async() -> Dict[str, int]:
+    """Count users by approval status (async version)"""
+    return await asyncio.to_thread(get_user_counts)
+
 def is_user_approved(telegram_id: int) -> bool:
     """
     Check if user is approved
@@ -198,8 +468,46 @@ def is_user_approved(telegram_id: int) -> bool:
     Returns:
         bool: True if approved, False otherwise
     """
-    user = get_user(telegram_id)
-    return user['approved'] if user else False
+    try:
+        with _connection() as conn:
+            row = conn.execute(SQL_IS_APPROVED, (telegram_id,)).fetchone()
+            return bool(row[0]) if row else False
+            
+    except sqlite3.Error as e:
+        logger.error(f"Error checking approval of user {telegram_id}: {e}")
+        return False
+
+def is_user_approved_cached(telegram_id: int) -> bool:
+    """
+    Check if user is approved, remembering the answer for a short time
+    
+    Args:
+        telegram_id: User's Telegram ID
+    
+    Returns:
+        bool: True if approved, False otherwise
+    """
+    approved, version = _cache_lookup(_approval_cache, telegram_id)
+    if approved is _MISSING:
+        approved = is_user_approved(telegram_id)
+        _cache_store(_approval_cache, telegram_id, approved, version)
+    return approved
+
+async def is_user_approved_async(telegram_id: int) -> bool:
+    """Check if user is approved without blocking the event loop on a cache miss"""
+    approved, version = _cache_lookup(_approval_cache, telegram_id)
+    if approved is _MISSING:
+        approved = await asyncio.to_thread(is_user_approved, telegram_id)
+        _cache_store(_approval_cache, telegram_id, approved, version)
+    return approved
+
+def invalidate_user_cache(telegram_id: int) -> None:
+    """Forget the cached user record and approval status of a user"""
+    global _cache_version
+    with _cache_lock:
+        _cache_version += 1
+        _approval_cache.pop(telegram_id, None)
+        _user_cache.pop(telegram_id, None)
 
 def delete_user(telegram_id: int) -> bool:
     """
@@ -212,16 +520,16 @@ def delete_user(telegram_id: int) -> bool:
         bool: True if successful, False otherwise
     """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with _connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+            cursor.execute(SQL_DELETE, (telegram_id,))
             
             if cursor.rowcount == 0:
                 logger.warning(f"User {telegram_id} not found for deletion")
                 return False
             
-            conn.commit()
+            invalidate_user_cache(telegram_id)
             logger.info(f"User {telegram_id} deleted successfully")
             return True
             
@@ -229,5 +537,9 @@ def delete_user(telegram_id: int) -> bool:
         logger.error(f"Error deleting user {telegram_id}: {e}")
         return False
 
+async def delete_user_async(telegram_id: int) -> bool:
+    """Delete a user from the database (async version)"""
+    return await asyncio.to_thread(delete_user, telegram_id)
+
 
 
@@ -0,0 +1,40 @@
+"""
+Bounded in-memory FSM storage
+"""
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+# Default number of FSM records kept in memory
+FSM_STORAGE_MAX_SIZE = 50_000
+
+class _LRURecords(OrderedDict):
+    """Records ordered by last access; the least recently used one is dropped when full"""
+    
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+    
+    def __missing__(self, key: Hashable) -> MemoryStorageRecord:
+        record = self[key] = MemoryStorageRecord()
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+        return record
+    
+    def __getitem__(self, key: Hashable) -> Any:
+        record = super().__getitem__(key)
+        self.move_to_end(key)
+        return record
+
+class LRUMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage that keeps at most max_size records
+    
+    Users who start registration and never finish it no longer pin their
+    state in memory forever: the least recently used record is evicted.
+    """
+    
+    def __init__(self, max_size: int = FSM_STORAGE_MAX_SIZE) -> None:
+        super().__init__()
+        self.storage = _LRURecords(max_size)
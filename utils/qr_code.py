@@ -1,10 +1,13 @@
 import qrcode
+import functools
 import logging
 import os
 from PIL import Image, ImageDraw, ImageFont
-from typing import Optional
+from typing import BinaryIO, Optional
 import io
 
+from config import config
+
 logger = logging.getLogger(__name__)
 
 # Design constants
@@ -12,12 +15,32 @@ QR_SIZE = 400
 IMAGE_SIZE = 512
 TEXT_COLOR = "#0a1411"  # Белый текст «Lethai»
 FONT_SIZE = 35
+# Уровень коррекции ошибок: логотипа поверх QR нет, M (15%) достаточно
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
 QR_OPACITY = 180  # 0..255, степень непрозрачности QR-фон (255 — полностью непрозрачный)
+BACKGROUND_PATH = os.path.join(os.path.dirname(__file__), 'background.jpg')
+CAPTION_TEXT = "Lethai services"
+CAPTION_OFFSET_X = 54  # сдвиг подписи вправо от центра
+REFERRAL_PREFIX = config.REFERRAL_LINK_PREFIX  # ссылка = префикс + партнёрский код
+# Сколько последних QR-карточек (~60 КБ каждая) держать в памяти
+QR_CACHE_SIZE = 128
+# Параметры JPEG: без второго прохода optimize; для контрастного QR q=80 визуально не хуже q=95
+JPEG_SAVE_OPTIONS = {"quality": 80, "subsampling": "4:2:0", "optimize": False, "progressive": False}
+
+# Позиция QR на фоне
+QR_X = (IMAGE_SIZE - QR_SIZE) // 2
+QR_Y = (IMAGE_SIZE - QR_SIZE) // 2 - 20
 
+# Таблицы для point(): маска модулей (255 — модуль) -> канал цвета / альфа
+_COLOR_LUT = [0 if value else 255 for value in range(256)]
+_ALPHA_LUT = [255 if value else QR_OPACITY for value in range(256)]
+
+@functools.lru_cache(maxsize=1)
 def get_font() -> Optional[ImageFont.FreeTypeFont]:
     """
     Загружает системный шрифт в Docker (DejaVuSans),
     если не найден — возвращает встроенный по умолчанию.
+    Шрифт загружается один раз за процесс (get_font.cache_clear() сбрасывает кэш).
     """
     try:
         font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
@@ -30,7 +53,34 @@ def get_font() -> Optional[ImageFont.FreeTypeFont]:
         logger.warning(f"Could not load custom font: {e}")
         return ImageFont.load_default()
 
-def _make_qr_on_transparent_bg(url: str) -> Image.Image:
+@functools.lru_cache(maxsize=1)
+def _render_backdrop() -> Image.Image:
+    """
+    Рисует неизменную часть картинки один раз: фон нужного размера и подпись
+    «Lethai services» под местом для QR. Вызывающий код должен работать с копией.
+    """
+    img = Image.open(BACKGROUND_PATH).convert("RGB")
+    if img.size != (IMAGE_SIZE, IMAGE_SIZE):
+        img = img.resize((IMAGE_SIZE, IMAGE_SIZE))
+    draw = ImageDraw.Draw(img)
+    
+    # Текст «Lethai» под QR
+    font = get_font()
+    bbox = draw.textbbox((0, 0), CAPTION_TEXT, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_x = (IMAGE_SIZE - text_width) // 2 + CAPTION_OFFSET_X
+    text_y = QR_Y + QR_SIZE + 20
+    draw.text((text_x, text_y), CAPTION_TEXT, fill=TEXT_COLOR, font=font)
+    return img
+
+def _compose(partnercode: str) -> Image.Image:
+    """Накладывает QR-код партнёра на копию готового фона с подписью"""
+    qr_img = _make_qr_on_transparent_bg(REFERRAL_PREFIX + str(partnercode))
+    img = _render_backdrop().copy()
+    img.paste(qr_img, (QR_X, QR_Y), qr_img)  # используем альфа из qr_img
+    return img
+
+def _make_qr_on_transparent_bg(url: str, error_correction: int = QR_ERROR_CORRECTION) -> Image.Image:
     """
     Создаёт изображение QR-кода (чёрные модули) на полупрозрачном белом фоне,
     возвращает RGBA изображение нужного размера QR_SIZE×QR_SIZE.
@@ -38,93 +88,69 @@ def _make_qr_on_transparent_bg(url: str) -> Image.Image:
     # Генерация QR (чёрный модули, белый фон)
     qr = qrcode.QRCode(
         version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        error_correction=error_correction,
         box_size=10,
         border=4,
     )
     qr.add_data(url)
     qr.make(fit=True)
-    base = qr.make_image(fill_color="black", back_color="white").convert("RGBA")
+    
+    # Маска модулей прямо из матрицы QR (с рамкой): 255 — тёмный модуль, 0 — фон.
+    # Одна ячейка матрицы = один пиксель, увеличиваем целым шагом без сглаживания,
+    # чтобы QR сразу влез в QR_SIZE — без LANCZOS-пересэмплирования.
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    box_size = max(1, QR_SIZE // size)
+    modules = Image.frombytes(
+        "L",
+        (size, size),
+        bytes(255 if cell else 0 for row in matrix for cell in row)
+    ).resize((size * box_size, size * box_size), resample=Image.NEAREST)
+    
+    # Остаток до QR_SIZE — фоном, QR по центру
+    mask = Image.new("L", (QR_SIZE, QR_SIZE), 0)
+    offset = (QR_SIZE - modules.width) // 2
+    mask.paste(modules, (offset, offset))
+    
+    # Фон — белый полупрозрачный (альфа QR_OPACITY), модули — чёрные непрозрачные
+    color = mask.point(_COLOR_LUT)
+    alpha = mask.point(_ALPHA_LUT)
+    return Image.merge("RGBA", (color, color, color, alpha))
 
-    # Теперь сделаем фон (белый) полупрозрачным, сохраняя модули чёрными полностью.
-    # То есть: если пиксель белый — он будет иметь альфа QR_OPACITY; если чёрный — альфа = 255.
-    data = base.getdata()
-    new_data = []
-    for (r, g, b, a) in data:
-        # Если белый фон (примерно белый) — заменяем на белый полупрозрачный
-        if (r, g, b) == (255, 255, 255):
-            new_data.append((255, 255, 255, QR_OPACITY))
-        else:
-            # чёрные модули остаются полностью непрозрачными (альфа=255)
-            new_data.append((0, 0, 0, 255))
-    base.putdata(new_data)
-    # Изменим размер, если надо
-    base = base.resize((QR_SIZE, QR_SIZE), resample=Image.LANCZOS)
-    return base
-
-def generate_qr_code(partnercode: str) -> Optional[str]:
+def generate_qr_code(partnercode: str, output: Optional[BinaryIO] = None) -> Optional[str]:
+    """
+    Сохраняет QR-карточку в qr_<код>.jpg и возвращает имя файла.
+    Если передан output (например, BytesIO), пишет туда без обращения к диску и возвращает "".
+    """
+    qr_bytes = generate_qr_code_bytes(partnercode)
+    if qr_bytes is None:
+        return None
+    
+    if output is not None:
+        output.write(qr_bytes)
+        return ""
+    
     try:
-        url = f"https://taplink.cc/lakeevainfo?ref={partnercode}"
-        qr_img = _make_qr_on_transparent_bg(url)
-        
-        # Load background
-        background_path = os.path.join(os.path.dirname(__file__), 'background.jpg')
-        img = Image.open(background_path).convert("RGB")
-        if img.size != (IMAGE_SIZE, IMAGE_SIZE):
-            img = img.resize((IMAGE_SIZE, IMAGE_SIZE))
-        draw = ImageDraw.Draw(img)
-        
-        # Позиция QR на фоне
-        qr_x = (IMAGE_SIZE - QR_SIZE) // 2
-        qr_y = (IMAGE_SIZE - QR_SIZE) // 2 - 20
-        
-        img.paste(qr_img, (qr_x, qr_y), qr_img)  # используем альфа из qr_img
-        
-        # Текст «Lethai» под QR
-        font = get_font()
-        text = "Lethai services"
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_x = (IMAGE_SIZE - text_width) // 2
-        text_y = qr_y + QR_SIZE + 20
-        draw.text((text_x, text_y), text, fill=TEXT_COLOR, font=font)
-        
         filename = f"qr_{partnercode}.jpg"
-        img.save(filename, "JPEG", quality=95)
+        with open(filename, "wb") as f:
+            f.write(qr_bytes)
         logger.info(f"QR code generated successfully: {filename}")
         return filename
-    except Exception as e:
-        logger.error(f"Error generating QR code for partnercode {partnercode}: {e}")
+    except OSError as e:
+        logger.error(f"Error saving QR code for partnercode {partnercode}: {e}")
         return None
 
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def _encode_qr(partnercode: str) -> bytes:
+    """JPEG-карточка партнёра; результат детерминирован, поэтому кэшируется по коду"""
+    buf = io.BytesIO()
+    _compose(partnercode).save(buf, format="JPEG", **JPEG_SAVE_OPTIONS)
+    logger.info(f"QR code generated as bytes for partnercode {partnercode}")
+    return buf.getvalue()
+
 def generate_qr_code_bytes(partnercode: str) -> Optional[bytes]:
     try:
-        url = f"https://taplink.cc/lakeevainfo?ref={partnercode}"
-        qr_img = _make_qr_on_transparent_bg(url)
-        
-        background_path = os.path.join(os.path.dirname(__file__), 'background.jpg')
-        img = Image.open(background_path).convert("RGB")
-        if img.size != (IMAGE_SIZE, IMAGE_SIZE):
-            img = img.resize((IMAGE_SIZE, IMAGE_SIZE))
-        draw = ImageDraw.Draw(img)
-        
-        qr_x = (IMAGE_SIZE - QR_SIZE) // 2
-        qr_y = (IMAGE_SIZE - QR_SIZE) // 2 - 20
-        img.paste(qr_img, (qr_x, qr_y), qr_img)
-        
-        font = get_font()
-        text = "Lethai services"
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_x = (IMAGE_SIZE - text_width) // 2 + 54
-        text_y = qr_y + QR_SIZE + 20
-        draw.text((text_x, text_y), text, fill=TEXT_COLOR, font=font)
-        
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=95)
-        buf.seek(0)
-        logger.info(f"QR code generated as bytes for partnercode {partnercode}")
-        return buf.getvalue()
+        return _encode_qr(partnercode)
     except Exception as e:
         logger.error(f"Error generating QR code bytes for partnercode {partnercode}: {e}")
         return None
@@ -143,10 +169,8 @@ def cleanup_qr_files() -> None:
         logger.error(f"Error during QR file cleanup: {e}")
 
 def get_referral_link(partnercode: str) -> str:
-    return f"https://taplink.cc/lakeevainfo?ref={partnercode}"
+    return REFERRAL_PREFIX + str(partnercode)
 
 def validate_partnercode(partnercode: str) -> bool:
-    try:
-        return partnercode.isdigit() and len(partnercode) > 0
-    except (TypeError, AttributeError):
-        return False
+    # isdigit() is False for "", isascii() rejects digits like "²" or "١"
+    return isinstance(partnercode, str) and partnercode.isascii() and partnercode.isdigit()
@@ -2,8 +2,15 @@
 Google Sheets integration for Lethai Concierge Referral Bot
 """
 import asyncio
+import functools
 import logging
-from typing import Optional
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from cachetools import TTLCache
 
 import gspread
 from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
@@ -11,19 +18,71 @@ from google.auth.exceptions import DefaultCredentialsError
 from google.oauth2.service_account import Credentials
 
 from config import config
+from utils import sheets_cache
 
 logger = logging.getLogger(__name__)
 
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    # Spreadsheet modifiedTime, used as the revision of the worksheet snapshot
+    'https://www.googleapis.com/auth/drive.metadata.readonly'
+]
+
+# Blocking Sheets calls run on their own bounded pool, so slow API requests
+# neither block the event loop nor starve the default executor used for sqlite
+SHEETS_MAX_WORKERS = 8
+_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+# Authorized client and worksheet, shared by all calls so the HTTP session
+# (and its TLS connections and OAuth token) is reused
+_client: Optional[gspread.Client] = None
+_worksheet: Optional[gspread.Worksheet] = None
+_client_lock = threading.Lock()
+
+# Recently read balances: partnercode -> balance
+BALANCE_CACHE_TTL = 60  # seconds
+_balance_cache: TTLCache = TTLCache(maxsize=10_000, ttl=BALANCE_CACHE_TTL)
+
+# Copy of the whole worksheet, split once into the header row and data rows:
+# (checked_at, header, data, partnercode -> data row index, revision).
+# After SNAPSHOT_TTL the spreadsheet revision is checked again and the rows are
+# downloaded only if it changed (or cannot be read)
+SNAPSHOT_TTL = 2.0  # seconds
+_snapshot: Optional[Tuple[float, List[str], List[List[str]], Dict[str, int], Optional[str]]] = None
+_snapshot_lock = threading.Lock()
+# Set once the Drive API refused the revision request; snapshots then expire as plain TTL copies
+_revision_unavailable = False
+# Rows of the last download are kept on disk with their revision for the next start
+SHEETS_CACHE_PATH = config.SHEETS_CACHE_PATH
+
+# Plain decimal amounts as entered in the sheet, with a dot or comma separator
+AMOUNT_PATTERN = re.compile(r'\s*[-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)\s*')
+
+# Partner rows waiting to be appended together by add_partnercode_async; each
+# batch is flushed by its own task, None while no batch is collecting rows
+APPEND_BATCH_DELAY = 0.05  # seconds
+_pending_appends: Optional[List[Tuple[List[str], asyncio.Future]]] = None
+_flush_tasks: Set[asyncio.Task] = set()
+
+async def _run_in_executor(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking Sheets call on the Sheets thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args))
 
 def get_client() -> gspread.Client:
-    """Get authorized gspread client"""
+    """Get the shared authorized gspread client, creating it on first use"""
+    global _client
+    if _client is not None:
+        return _client
     try:
-        credentials = Credentials.from_service_account_file(
-            config.CREDENTIALS_PATH,
-            scopes=SCOPES
-        )
-        return gspread.authorize(credentials)
+        with _client_lock:
+            if _client is None:
+                credentials = Credentials.from_service_account_file(
+                    config.CREDENTIALS_PATH,
+                    scopes=SCOPES
+                )
+                _client = gspread.authorize(credentials)
+            return _client
     except FileNotFoundError:
         logger.error(f"Credentials file not found: {config.CREDENTIALS_PATH}")
         raise
@@ -34,18 +93,169 @@ def get_client() -> gspread.Client:
         logger.error(f"Unexpected error creating client: {e}")
         raise
 
+def _open_worksheet() -> gspread.Worksheet:
+    """Get the configured worksheet, opening it once"""
+    global _worksheet
+    if _worksheet is not None:
+        return _worksheet
+    client = get_client()
+    with _client_lock:
+        if _worksheet is None:
+            sheet = client.open_by_key(config.SHEETS_ID)
+            _worksheet = sheet.worksheet(config.SHEET_NAME)
+        return _worksheet
+
+def _reset_clients() -> None:
+    """Forget the shared client and worksheet; the next call authorizes again"""
+    global _client, _worksheet, _revision_unavailable
+    with _client_lock:
+        _client = None
+        _worksheet = None
+        # New credentials may be allowed to read the revision
+        _revision_unavailable = False
+
+def _reset_clients_on_auth_error(error: Exception) -> None:
+    """Drop the shared client when Google rejected its credentials (HTTP 401)"""
+    if isinstance(error, APIError) and error.code == 401:
+        logger.warning("Google Sheets rejected the credentials, authorizing again on next call")
+        _reset_clients()
+
+def _build_snapshot(
+    rows: List[List[str]],
+    revision: Optional[str],
+    checked_at: Optional[float] = None
+) -> Tuple[float, List[str], List[List[str]], Dict[str, int], Optional[str]]:
+    """Split off the header, index data rows by partnercode and stamp them with the check time (default: now)"""
+    header, data = (rows[0], rows[1:]) if rows else ([], [])
+    # Iterate backwards so the first row wins for duplicated codes, like worksheet.find
+    index = {
+        data[i][0]: i
+        for i in range(len(data) - 1, -1, -1)
+        if data[i] and data[i][0]
+    }
+    return time.monotonic() if checked_at is None else checked_at, header, data, index, revision
+
+def _cache_key() -> str:
+    """Key of the configured worksheet in the on-disk cache"""
+    return f"{config.SHEETS_ID}:{config.SHEET_NAME}"
+
+def _get_revision(worksheet: gspread.Worksheet) -> Optional[str]:
+    """Drive modifiedTime of the spreadsheet, or None if it cannot be read"""
+    global _revision_unavailable
+    if _revision_unavailable:
+        return None
+    try:
+        return worksheet.spreadsheet.get_lastUpdateTime()
+    except APIError as e:
+        _reset_clients_on_auth_error(e)
+        if e.code == 403:
+            # Drive API disabled for the project or scope not granted
+            _revision_unavailable = True
+            logger.warning(f"Spreadsheet revision unavailable, the worksheet will be downloaded on every refresh: {e}")
+        else:
+            logger.warning(f"Error reading spreadsheet revision: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"Error reading spreadsheet revision: {e}")
+        return None
+
+def _get_snapshot(ttl: float = SNAPSHOT_TTL) -> Tuple[List[str], List[List[str]], Dict[str, int]]:
+    """
+    Get the worksheet header, data rows and their partnercode index, reusing
+    a snapshot checked less than ttl seconds ago
+    
+    An older snapshot is kept if the spreadsheet revision has not changed since
+    it was downloaded. Concurrent callers wait for a single check or download
+    instead of each going to the API. New downloads are also saved to disk.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None and time.monotonic() - _snapshot[0] < ttl:
+            return _snapshot[1:4]
+        try:
+            worksheet = _open_worksheet()
+            # Read before the rows, so a change made during the download is never missed
+            revision = _get_revision(worksheet)
+            if _snapshot is not None and revision is not None and revision == _snapshot[4]:
+                _snapshot = (time.monotonic(),) + _snapshot[1:]
+                return _snapshot[1:4]
+            rows = worksheet.get_all_values()
+        except APIError as e:
+            _reset_clients_on_auth_error(e)
+            raise
+        _snapshot = snapshot = _build_snapshot(rows, revision)
+    
+    # Written outside the lock so lookups are not held up by the disk
+    if revision is not None:
+        sheets_cache.save_rows(SHEETS_CACHE_PATH, _cache_key(), revision, [snapshot[1]] + snapshot[2])
+    return snapshot[1:4]
+
+def _load_saved_snapshot() -> bool:
+    """
+    Use the rows saved by a previous run as the current snapshot, if there is none yet
+    
+    The saved snapshot starts out expired, so the first lookup compares its
+    revision with the spreadsheet and downloads the sheet only if it changed.
+    """
+    global _snapshot
+    saved = sheets_cache.load_rows(SHEETS_CACHE_PATH, _cache_key())
+    if saved is None:
+        return False
+    revision, rows = saved
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = _build_snapshot(rows, revision, checked_at=float('-inf'))
+    return True
+
+async def warm_snapshot_async() -> None:
+    """Load the rows saved by the previous run and check them against the live sheet"""
+    if await _run_in_executor(_load_saved_snapshot):
+        logger.info("Loaded saved worksheet snapshot")
+    try:
+        await _run_in_executor(_get_snapshot)
+    except Exception as e:
+        logger.error(f"Error refreshing worksheet snapshot: {e}")
+
+def _get_rows_cached(ttl: float = SNAPSHOT_TTL) -> Tuple[List[str], List[List[str]]]:
+    """Get the header row and the data rows from the snapshot"""
+    return _get_snapshot(ttl)[:2]
+
+def _find_row(partnercode: str) -> Optional[List[str]]:
+    """Get the snapshot row of a partnercode, or None if it is not in the sheet"""
+    _, data, index = _get_snapshot()
+    row_index = index.get(partnercode)
+    return data[row_index] if row_index is not None else None
+
+def _record_appended(rows: List[List[str]]) -> None:
+    """
+    Add rows just appended to the sheet to the current snapshot, so the
+    following existence checks do not download the sheet again
+    """
+    with _snapshot_lock:
+        if _snapshot is None:
+            return
+        data, index = _snapshot[2], _snapshot[3]
+        for row in rows:
+            index.setdefault(row[0], len(data))
+            data.append(row)
+
+def _invalidate_cache() -> None:
+    """Drop the worksheet snapshot after writing to the sheet"""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
 def _test_connection_sync() -> bool:
     """Synchronous test of Google Sheets connection"""
     try:
-        client = get_client()
-        sheet = client.open_by_key(config.SHEETS_ID)
-        worksheet = sheet.worksheet(config.SHEET_NAME)
+        worksheet = _open_worksheet()
         worksheet.cell(1, 1).value  # Test read access
         return True
     except (SpreadsheetNotFound, WorksheetNotFound):
         logger.error("Spreadsheet or worksheet not found")
         return False
     except APIError as e:
+        _reset_clients_on_auth_error(e)
         logger.error(f"API error: {e}")
         return False
     except Exception as e:
@@ -58,7 +268,7 @@ def test_connection() -> bool:
 
 async def test_connection_async() -> bool:
     """Test Google Sheets connection (async version)"""
-    return await asyncio.to_thread(_test_connection_sync)
+    return await _run_in_executor(_test_connection_sync)
 
 def _safe_value(val) -> str:
     """Convert value to string, return '-' if empty"""
@@ -67,6 +277,49 @@ def _safe_value(val) -> str:
     val_str = str(val).strip()
     return val_str if val_str else "-"
 
+def _partner_row(
+    partnercode: str,
+    name: Optional[str] = None,
+    contact: Optional[str] = None,
+    username: Optional[str] = None,
+    referral_source: Optional[str] = None
+) -> List[str]:
+    """Build a sheet row: [Partner ID, Name, Contact, Telegram Username, Referral Source]"""
+    # Format username with @ prefix if not present
+    formatted_username = _safe_value(username)
+    if formatted_username != "-" and not formatted_username.startswith("@"):
+        formatted_username = f"@{formatted_username}"
+    
+    return [
+        str(partnercode),
+        _safe_value(name),
+        _safe_value(contact),
+        formatted_username,
+        _safe_value(referral_source)
+    ]
+
+def _partnercode_exists(partnercode: str) -> bool:
+    """Check the worksheet snapshot for a partnercode"""
+    row_index = _get_snapshot()[2].get(partnercode)
+    if row_index is not None:
+        # Data rows start at sheet row 2
+        logger.info(f"Partnercode {partnercode} already exists in row {row_index + 2}")
+        return True
+    return False
+
+def _append_rows_sync(rows: List[List[str]]) -> bool:
+    """Append rows to the worksheet with a single API request"""
+    try:
+        _open_worksheet().append_rows(rows, value_input_option="USER_ENTERED")
+        _record_appended(rows)
+        for row in rows:
+            logger.info(f"Added partner {row[0]} with full data to Google Sheets")
+        return True
+    except Exception as e:
+        _reset_clients_on_auth_error(e)
+        logger.error(f"Error adding partners {', '.join(row[0] for row in rows)}: {e}")
+        return False
+
 def _add_partnercode_sync(
     partnercode: str,
     name: Optional[str] = None,
@@ -80,38 +333,13 @@ def _add_partnercode_sync(
     Appends row with: [Partner ID, Name, Contact, Telegram Username, Referral Source]
     """
     try:
-        client = get_client()
-        sheet = client.open_by_key(config.SHEETS_ID)
-        worksheet = sheet.worksheet(config.SHEET_NAME)
-        
-        # Find if partnercode exists
-        cell = worksheet.find(partnercode, in_column=1)
-        if cell:
-            logger.info(f"Partnercode {partnercode} already exists in row {cell.row}")
+        if _partnercode_exists(partnercode):
             return True
-        
-        # Format username with @ prefix if not present
-        formatted_username = _safe_value(username)
-        if formatted_username != "-" and not formatted_username.startswith("@"):
-            formatted_username = f"@{formatted_username}"
-        
-        # Build row data: [Partner ID, Name, Contact, Username, Referral Source]
-        row_data = [
-            str(partnercode),
-            _safe_value(name),
-            _safe_value(contact),
-            formatted_username,
-            _safe_value(referral_source)
-        ]
-        
-        # Append row
-        worksheet.append_row(row_data, value_input_option="USER_ENTERED")
-        logger.info(f"Added partner {partnercode} with full data to Google Sheets")
-        return True
-        
     except Exception as e:
         logger.error(f"Error adding partner {partnercode}: {e}")
         return False
+    
+    return _append_rows_sync([_partner_row(partnercode, name, contact, username, referral_source)])
 
 def add_partnercode(
     partnercode: str,
@@ -142,34 +370,79 @@ async def add_partnercode_async(
     username: Optional[str] = None,
     referral_source: Optional[str] = None
 ) -> bool:
-    """Add partner data to Google Sheets (async version)"""
-    return await asyncio.to_thread(_add_partnercode_sync, partnercode, name, contact, username, referral_source)
+    """
+    Add partner data to Google Sheets (async version)
+    
+    Rows added within APPEND_BATCH_DELAY of each other are written with one
+    append_rows request; every caller gets the result of that request.
+    """
+    try:
+        if await _run_in_executor(_partnercode_exists, partnercode):
+            return True
+    except Exception as e:
+        logger.error(f"Error adding partner {partnercode}: {e}")
+        return False
+    
+    global _pending_appends
+    future = asyncio.get_running_loop().create_future()
+    if _pending_appends is None:
+        # The first row of a new batch schedules its flush
+        _pending_appends = []
+        task = asyncio.create_task(_flush_appends(_pending_appends))
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+        task.add_done_callback(functools.partial(_close_batch, _pending_appends))
+    _pending_appends.append((_partner_row(partnercode, name, contact, username, referral_source), future))
+    return await future
+
+async def _flush_appends(batch: List[Tuple[List[str], asyncio.Future]]) -> None:
+    """Write a batch of queued partner rows after a short delay so concurrent adds share one request"""
+    global _pending_appends
+    await asyncio.sleep(APPEND_BATCH_DELAY)
+    if _pending_appends is batch:
+        _pending_appends = None
+    
+    # Concurrent adds of the same partner all passed the existence check; write it once
+    rows: Dict[str, List[str]] = {}
+    for row, _ in batch:
+        rows.setdefault(row[0], row)
+    success = await _run_in_executor(_append_rows_sync, list(rows.values()))
+    for _, future in batch:
+        if not future.done():
+            future.set_result(success)
+
+def _close_batch(batch: List[Tuple[List[str], asyncio.Future]], task: asyncio.Task) -> None:
+    """
+    Answer the callers of a batch whose flush ended without doing so, e.g. when
+    the task was cancelled at shutdown, possibly before it even started
+    """
+    global _pending_appends
+    if _pending_appends is batch:
+        _pending_appends = None
+    for _, future in batch:
+        if not future.done():
+            future.set_result(False)
+
+def _sum_amounts(values: List[str]) -> float:
+    """Sum numeric cells, skipping blanks and text; comma decimals are accepted"""
+    total = 0.0
+    for value in values:
+        # Matching first avoids raising ValueError for every text cell
+        if value and AMOUNT_PATTERN.fullmatch(value):
+            total += float(value.replace(',', '.'))
+    return total
 
 def _get_balance_sync(partnercode: str) -> float:
-    """Synchronous get balance for partnercode"""
+    """Synchronous get balance for partnercode, skipping first 4 columns"""
     try:
-        client = get_client()
-        sheet = client.open_by_key(config.SHEETS_ID)
-        worksheet = sheet.worksheet(config.SHEET_NAME)
-        
         # Find row
-        cell = worksheet.find(partnercode, in_column=1)
-        if not cell:
+        row_values = _find_row(partnercode)
+        if row_values is None:
             logger.warning(f"Partnercode {partnercode} not found")
             return 0.0
         
-        # Get row values
-        row_values = worksheet.row_values(cell.row)
-        if not row_values:
-            return 0.0
-        
-        # Sum numeric values skipping first column
-        balance = 0.0
-        for value in row_values[1:]:
-            try:
-                balance += float(value)
-            except ValueError:
-                continue
+        # Sum numeric values starting from 5th column (index 4)
+        balance = _sum_amounts(row_values[4:])
         
         logger.info(f"Balance for {partnercode}: {balance}")
         return balance
@@ -183,21 +456,22 @@ def get_balance(partnercode: str) -> float:
     return _get_balance_sync(partnercode)
 
 async def get_balance_async(partnercode: str) -> float:
-    """Get balance for partnercode (async version)"""
-    return await asyncio.to_thread(_get_balance_sync, partnercode)
+    """Get balance for partnercode (async version, cached for BALANCE_CACHE_TTL seconds)"""
+    try:
+        return _balance_cache[partnercode]
+    except KeyError:
+        balance = await _run_in_executor(_get_balance_sync, partnercode)
+        _balance_cache[partnercode] = balance
+        return balance
 
 def _get_worksheet_info_sync() -> dict:
     """Synchronous get worksheet info"""
     try:
-        client = get_client()
-        sheet = client.open_by_key(config.SHEETS_ID)
-        worksheet = sheet.worksheet(config.SHEET_NAME)
-        
-        all_values = worksheet.get_all_values()
-        row_count = len(all_values)
+        header, data = _get_rows_cached()
+        row_count = len(data) + (1 if header else 0)
         
-        # Count partnercodes (non-empty first column cells, excluding header)
-        partnercode_count = sum(1 for row in all_values[1:] if row and row[0])
+        # Count partnercodes (non-empty first column cells of data rows)
+        partnercode_count = sum(1 for row in data if row and row[0])
         
         return {
             'row_count': row_count,
@@ -207,46 +481,13 @@ def _get_worksheet_info_sync() -> dict:
         logger.error(f"Error getting worksheet info: {e}")
         return {}
 
-def _get_balance_sync(partnercode: str) -> float:
-    """Synchronous get balance for partnercode, skipping first 4 columns"""
-    try:
-        client = get_client()
-        sheet = client.open_by_key(config.SHEETS_ID)
-        worksheet = sheet.worksheet(config.SHEET_NAME)
-        
-        # Find row
-        cell = worksheet.find(partnercode, in_column=1)
-        if not cell:
-            logger.warning(f"Partnercode {partnercode} not found")
-            return 0.0
-        
-        # Get row values
-        row_values = worksheet.row_values(cell.row)
-        if not row_values:
-            return 0.0
-        
-        # Sum numeric values starting from 5th column (index 4)
-        balance = 0.0
-        for value in row_values[4:]:
-            try:
-                balance += float(value)
-            except ValueError:
-                continue
-        
-        logger.info(f"Balance for {partnercode}: {balance}")
-        return balance
-        
-    except Exception as e:
-        logger.error(f"Error getting balance for {partnercode}: {e}")
-        return 0.0
-        
 def get_worksheet_info() -> dict:
     """Get worksheet info (synchronous wrapper for backwards compatibility)"""
     return _get_worksheet_info_sync()
 
 async def get_worksheet_info_async() -> dict:
     """Get worksheet info (async version)"""
-    return await asyncio.to_thread(_get_worksheet_info_sync)
+    return await _run_in_executor(_get_worksheet_info_sync)
 
 if __name__ == "__main__":
     # Test functions
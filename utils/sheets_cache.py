@@ -0,0 +1,67 @@
+"""
+On-disk copy of the worksheet rows with the spreadsheet revision they were
+downloaded at, so a restart can skip the download while the sheet is unchanged
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SQL_CREATE = "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, ts REAL NOT NULL)"
+SQL_LOAD = "SELECT value FROM kv WHERE key = ?"
+SQL_SAVE = "INSERT OR REPLACE INTO kv (key, value, ts) VALUES (?, ?, ?)"
+
+def _connect(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute(SQL_CREATE)
+    return conn
+
+def load_rows(path: str, key: str) -> Optional[Tuple[str, List[List[str]]]]:
+    """
+    Read saved rows
+    
+    Args:
+        path: Cache database file
+        key: Worksheet key the rows were saved under
+    
+    Returns:
+        (revision, rows), or None if nothing usable is saved
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = _connect(path)
+        try:
+            row = conn.execute(SQL_LOAD, (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        saved = json.loads(row[0])
+        if not isinstance(saved, dict) or not isinstance(saved.get('revision'), str) \
+                or not isinstance(saved.get('rows'), list):
+            return None
+        return saved['revision'], saved['rows']
+    except (sqlite3.Error, ValueError) as e:
+        logger.error(f"Error loading sheet cache from {path}: {e}")
+        return None
+
+def save_rows(path: str, key: str, revision: str, rows: List[List[str]]) -> None:
+    """Replace the saved rows of a worksheet and the revision they were downloaded at"""
+    value = json.dumps({'revision': revision, 'rows': rows}, ensure_ascii=False)
+    try:
+        conn = _connect(path)
+        try:
+            with conn:
+                conn.execute(SQL_SAVE, (key, value, time.time()))
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Error saving sheet cache to {path}: {e}")